@@ -21,12 +21,11 @@ def onPlayerConnect(p):
 	if p.isAlive(): return
 	
 	# place player on the team with least players
-	team1 = 0
-	team2 = 0
-	for tp in bf2.playerManager.getPlayers():
-		if tp != p:
-			if tp.getTeam() == 1: team1 += 1
-			else: team2 += 1	
+	players = bf2.playerManager.getPlayers()
+	others = len(players)
+	if p in players: others -= 1
+	team1 = bf2.playerManager.getNumberOfPlayersInTeam(1, p)
+	team2 = others - team1
 			
 	team2 = team2 * bf2.serverSettings.getTeamRatioPercent() / 100.0		
 	if team2 > team1:
@@ -51,18 +50,11 @@ def onPlayerDeath(p, vehicle):
 		p.setSuicide(0)
 		return
 	
-	aiPlayerBalance = 0
-	team1 = 0
-	team2 = 0
-	for tp in bf2.playerManager.getPlayers():	
-		if tp.getTeam() == 1:
-			team1 += 1
-		else:
-			team2 += 1
-		if tp.isAIPlayer():
-			aiPlayerBalance += 1
-		else:
-			aiPlayerBalance -= 1					
+	numPlayers = len(bf2.playerManager.getPlayers())
+	team1 = bf2.playerManager.getNumberOfPlayersInTeam(1)
+	team2 = numPlayers - team1
+	numAIPlayers = bf2.playerManager.getNumberOfAIPlayers()
+	aiPlayerBalance = numAIPlayers - (numPlayers - numAIPlayers)
 	
 	if host.sgl_getIsAIGame():
 		if not (host.ss_getParam('gameMode') == "gpm_coop"):
@@ -96,8 +88,8 @@ def onPlayerChangeTeams(p, humanHasSpawned):
 		team = p.getTeam()	
 		aiplayer = 0	
 	
-		for tp in bf2.playerManager.getPlayers():		
-			if aiplayer == 0 and tp.getTeam() == team and tp.isAIPlayer(): 
+		for tp in bf2.playerManager.getPlayersInTeam(team):		
+			if tp.isAIPlayer(): 
 				aiplayer = tp
 				break
 		
@@ -107,11 +99,8 @@ def onPlayerChangeTeams(p, humanHasSpawned):
 									
 	else:
 		# checking to see if player is allowed to change teams
-		team1 = 0
-		team2 = 0
-		for tp in bf2.playerManager.getPlayers():	
-			if tp.getTeam() == 1: team1 += 1
-			else: team2 += 1
+		team1 = bf2.playerManager.getNumberOfPlayersInTeam(1)
+		team2 = len(bf2.playerManager.getPlayers()) - team1
 		if abs(team1 - team2) > 1:
 			if p.getTeam() == 1: p.setTeam(2)
 			else: p.setTeam(1)
@@ -8,15 +8,14 @@ TK_PUNISH_TIME = 20
 TK_PUNISH_COMMANDID = 100
 TK_FORGIVE_COMMANDID = 101
 
-hasPendingTks = {}
-updateTimer = None
+# (victim, attacker) -> scheduled expiry of each pending teamkill, oldest first
+pendingTks = {}
 
 
 
 class TkData:
 	def __init__(self):
 		self.punished = 0
-		self.pending = []
 		self.lastTKedBy = None
 
 
@@ -31,60 +30,26 @@ def init():
 	# Connect already connected players if reinitializing
 	for p in bf2.playerManager.getPlayers():
 		onPlayerConnect(p)
-	
-	checkEnable()
 
 
 
 def checkEnable():
-	global updateTimer
-	
-	if not bf2.serverSettings.getTKPunishEnabled():
-		if updateTimer:
-			updateTimer.destroy()
-			updateTimer = None
-		return False
-	else:
-		if not updateTimer:
-			updateTimer = bf2.Timer(onUpdate, 10, 1)
-			updateTimer.setRecurring(10)
-			
-		return True
+	return bf2.serverSettings.getTKPunishEnabled()
 	
 
-def onUpdate(data):
+def onTkExpired(key):
+	# pending teamkills of a pair share the same delay, so the oldest one expires first
+	calls = pendingTks[key]
+	del calls[0]
+	if len(calls) == 0:
+		del pendingTks[key]
+
 	if not checkEnable(): return
-	global hasPendingTks
-
-	currentTime = host.timer_getWallTime()
-
-	newPending = {}
-	for attacker in hasPendingTks.iterkeys():
-		newList = []
-
-		for tk in attacker.tkData.pending:
-			tkDate = tk[0]
-			tkVictim = tk[1]
-
-			# check if there is a pending TK with time expired
-			if tkDate + TK_PUNISH_TIME < currentTime:
-				if bf2.serverSettings.getTKPunishByDefault():
-					attacker.tkData.punished += 1
-					checkPunishLimit(attacker)
-
-				# remove player from global list, if it was the last tk
-				if len(attacker.tkData.pending) == 1:
-					pass
-				else:
-					newPending[attacker] = 1
-			
-			else:
-				newList += [tk]
-				newPending[attacker] = 1
-		
-		attacker.tkData.pending = newList
 
-	hasPendingTks = newPending
+	if bf2.serverSettings.getTKPunishByDefault():
+		attacker = key[1]
+		attacker.tkData.punished += 1
+		checkPunishLimit(attacker)
 	
 
 						
@@ -140,9 +105,10 @@ def onPlayerKilled(victim, attacker, weapon, assists, object):
 #HF Stop
 		
 	# ok, we have a teamkill
-	currentTime = host.timer_getWallTime()
-	attacker.tkData.pending += [(currentTime, victim)]
-	hasPendingTks[attacker] = 1
+	key = (victim, attacker)
+	if not key in pendingTks:
+		pendingTks[key] = []
+	pendingTks[key].append(bf2.scheduler.schedule(onTkExpired, TK_PUNISH_TIME, key))
 		
 	victim.tkData.lastTKedBy = attacker # can only punish / forgive the last TK'er
 	
@@ -155,28 +121,16 @@ def executePunishAction(victim, punish):
 	attacker = victim.tkData.lastTKedBy
 	if attacker == None or not attacker.isValid(): return
 
-	global hasPendingTks
-
-	currentTime = host.timer_getWallTime()
-	
-	newList = []
-	for tk in attacker.tkData.pending:
-		tkDate = tk[0]
-		tkVictim = tk[1]
-		
-		# if the attacker had a pending tk, and time has not run out
-		if tkVictim == victim and tkDate + TK_PUNISH_TIME > currentTime:
+	# every teamkill still pending for this pair is within its punish time
+	key = (victim, attacker)
+	if key in pendingTks:
+		for call in pendingTks[key]:
+			call.cancel()
 			if punish:
 				attacker.tkData.punished += 1
 				bf2.gameLogic.sendClientCommand(-1, 100, (0, victim.index, attacker.index)) # 100 = tkpunish event, 0 = punish
 			else:
 				bf2.gameLogic.sendClientCommand(-1, 100, (1, victim.index, attacker.index)) # 100 = tkpunish event, 1 = forgive
-		else:
-			newList += [tk]
-			
-	attacker.tkData.pending = newList
-	
-	if len(attacker.tkData.pending) == 0:
-		del hasPendingTks[attacker]
+		del pendingTks[key]
 	
 	checkPunishLimit(attacker)
@@ -1,9 +1,31 @@
 import host
+from bf2.Timer import Timer
+
+# events after which the vehicle hierarchy may have changed
+hierarchyEvents = ('EnterVehicle', 'ExitVehicle', 'VehicleDestroyed', 'PlayerDeath', 'Reset')
+
+# interval of the backstop timer that drops resolved root parents once per engine tick
+ROOT_CACHE_TICK = 0.03
 
 
 class ObjectManager:
 	def __init__(self):
 		print "ObjectManager created"
+		self._roots = None
+		self._rootTimer = None
+
+	# hooks up the root parent cache. until this is called every lookup walks
+	# the hierarchy through the host.
+	def init(self):
+		if self._roots != None: return
+
+		for event in hierarchyEvents:
+			host.registerHandler(event, self._clearRootCache, 1)
+		host.registerGameStatusHandler(self._clearRootCache)
+
+		self._roots = {}
+		self._rootTimer = Timer(self._clearRootCache, ROOT_CACHE_TICK, 1)
+		self._rootTimer.setRecurring(ROOT_CACHE_TICK)
 
 	def getObjectsOfType(self, type):
 		return host.omgr_getObjectsOfType(type)
@@ -12,9 +34,25 @@ class ObjectManager:
 		return host.omgr_getObjectsOfTemplate(templ)
 
 	def getRootParent(self, obj):
+		roots = self._roots
+		if roots != None and roots.has_key(obj):
+			return roots[obj]
+
+		visited = [obj]
 		parent = obj.getParent()
-		
-		if parent == None:
-			return obj
-			
-		return self.getRootParent(parent)
+		while parent != None:
+			if roots != None and roots.has_key(parent):
+				obj = roots[parent]
+				break
+			obj = parent
+			visited.append(obj)
+			parent = obj.getParent()
+
+		# everything on the way up shares the same root
+		if roots != None:
+			for o in visited:
+				roots[o] = obj
+		return obj
+
+	def _clearRootCache(self, *args):
+		if self._roots: self._roots.clear()
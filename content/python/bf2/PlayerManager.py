@@ -1,109 +1,374 @@
 
 import host
+import array
+from bf2.Timer import Timer
 
 # ingame scoremanager link
 ingameScores = ('deaths','kills','TKs','score','skillScore','rplScore','cmdScore','fracScore','rank','firstPlace','secondPlace','thirdPlace',
 		'bulletsFired','bulletsGivingDamage','bulletsFiredAndClear','bulletsGivingDamageAndClear')
 
-class PlayerScore:
+# these scores are only tracked in script
+scriptScores = ('heals','ammos','repairs','damageAssists','passengerAssists','driverAssists','targetAssists','driverSpecials',
+		'revives','teamDamages','teamVehicleDamages','cpCaptures','cpDefends','cpAssists','suicides','cpNeutralizes','cpNeutralizeAssists')
+
+# ingame scores that are plain counters. the bullet lists are left out, as
+# the *AndClear variants reset the engine side when read.
+counterScores = ingameScores[:12]
+
+_noScripted = (0,) * len(scriptScores)
+
+# bit of each script-side counter in the masks returned by PlayerScore.changedSince()
+scoreBits = {}
+for i in range(len(scriptScores)):
+	scoreBits[scriptScores[i]] = 1 << i
+
+# number of recent changes kept per player for cheap changedSince() queries
+SCORE_CHANGELOG_SIZE = 32
+
+# accessors used by PlayerScore, rebound by PlayerManager.enableSnapshots()
+_getScore = host.pmgr_getScore
+_setScore = host.pmgr_setScore
+
+class PlayerScore(object):
+	"""Fixed-field score record. Script-side counters live in a flat list, ingame
+	scores are properties that go through the host.
+
+	Every change to a script-side counter bumps the record's serial, so consumers
+	can take a checkpoint() and later ask which counters changedSince() it."""
+	__slots__ = ('index', 'scripted', 'serial', 'stamps', 'changelog')
+
 	def __init__(self, index):
-		self.__dict__['index'] = index
-		self.reset()
+		self.index = index
+		self.scripted = list(_noScripted)
+		self.serial = 0
+		self.stamps = list(_noScripted)
+		self.changelog = []
 
 	def reset(self):
-		# these scores are only tracked in script
-		self.__dict__['heals'] = 0
-		self.__dict__['ammos'] = 0
-		self.__dict__['repairs'] = 0
-		self.__dict__['damageAssists'] = 0
-		self.__dict__['passengerAssists'] = 0
-		self.__dict__['driverAssists'] = 0
-		self.__dict__['targetAssists'] = 0
-		self.__dict__['driverSpecials'] = 0
-		self.__dict__['revives'] = 0
-		self.__dict__['teamDamages'] = 0
-		self.__dict__['teamVehicleDamages'] = 0
-		self.__dict__['cpCaptures'] = 0
-		self.__dict__['cpDefends'] = 0
-		self.__dict__['cpAssists'] = 0
-		self.__dict__['suicides'] = 0
-		self.__dict__['cpNeutralizes'] = 0
-		self.__dict__['cpNeutralizeAssists'] = 0
-
-	def __getattr__(self, name):
-		if name in self.__dict__: return self.__dict__[name]
-		elif name == 'dkRatio':
-			kills = host.pmgr_getScore(self.index, 'kills')
-			if kills == 0:
-				# div by zero is undefined -> 0:0 = 1 1:0 = 2 1:1 = 1
-				return 1.0 * host.pmgr_getScore(self.index, 'deaths') + 1 
-			else:
-				return 1.0 * host.pmgr_getScore(self.index, 'deaths') / kills
-		elif name in ingameScores: 
-			return host.pmgr_getScore(self.index, name)
+		# a reset is not a change; checkpoints taken before it see nothing changed
+		self.scripted[:] = _noScripted
+		self.stamps[:] = _noScripted
+		self.changelog = []
+
+	def checkpoint(self):
+		return self.serial
+
+	# returns the scoreBits mask of counters changed after the given checkpoint
+	def changedSince(self, token):
+		count = self.serial - token
+		mask = 0
+		if count <= 0:
+			return mask
+		if count <= len(self.changelog):
+			for bit in self.changelog[-count:]:
+				mask |= bit
 		else:
-			raise AttributeError, name
+			stamps = self.stamps
+			for i in range(len(stamps)):
+				if stamps[i] > token:
+					mask |= 1 << i
+		return mask
 
-	def __setattr__(self, name, value):
-		if name in self.__dict__: 
-			self.__dict__[name] = value 
-			return None
-		elif name in ingameScores: 
-			return host.pmgr_setScore(self.index, name, value)
+	# reads a set of ingame scores in one pass, in the order given
+	def read(self, names=counterScores):
+		index = self.index
+		getScore = _getScore
+		return tuple([getScore(index, name) for name in names])
+
+	def getDkRatio(self):
+		kills = _getScore(self.index, 'kills')
+		if kills == 0:
+			# div by zero is undefined -> 0:0 = 1 1:0 = 2 1:1 = 1
+			return 1.0 * _getScore(self.index, 'deaths') + 1 
 		else:
-			raise AttributeError, name
+			return 1.0 * _getScore(self.index, 'deaths') / kills
+
+	dkRatio = property(getDkRatio)
+
+def _scriptScoreProperty(i):
+	bit = 1 << i
+	def get(self): return self.scripted[i]
+	def set(self, value):
+		if value == self.scripted[i]: return
+		self.scripted[i] = value
+		self.serial += 1
+		self.stamps[i] = self.serial
+		self.changelog.append(bit)
+		if len(self.changelog) > SCORE_CHANGELOG_SIZE:
+			del self.changelog[:SCORE_CHANGELOG_SIZE / 2]
+	return property(get, set)
+
+def _ingameScoreProperty(name):
+	def get(self): return _getScore(self.index, name)
+	def set(self, value): return _setScore(self.index, name, value)
+	return property(get, set)
+
+for i in range(len(scriptScores)):
+	setattr(PlayerScore, scriptScores[i], _scriptScoreProperty(i))
+for name in ingameScores:
+	setattr(PlayerScore, name, _ingameScoreProperty(name))
+del i, name
 
 		
 
+# player attributes that the snapshot layer serves from its table. anything
+# not listed here (and all writes) always goes straight to the host.
+snapshotAttributes = ('remote','ai','alive','mandown','connected','profileid','fholder','team','ping','suicide','tts',
+		'sqid','isql','commander','name','sgr','kit','vehicle','defaultvehicle','addr','isInsideCP')
+
+# events after which snapshotted attributes can no longer be trusted
+snapshotEvents = ('PlayerConnect','PlayerDisconnect','PlayerSpawn','PlayerDeath','PlayerKilled','PlayerChangeTeams',
+		'EnterVehicle','ExitVehicle','PickupKit','DropKit','PlayerChangedSquad','ChangedCommander','ChangedSquadLeader',
+		'PlayerRevived','PlayerBanned','PlayerKicked','PlayerScore','Reset')
+
+# interval of the backstop timer that drops the snapshot once per engine tick
+SNAPSHOT_TICK = 0.03
+
+MAX_PLAYER_INDEX = 255
+
+# interval of the consistency check of the team roster against the host
+ROSTER_CHECK_INTERVAL = 30
+
+# accessors used by Player, rebound by PlayerManager.enableSnapshots()
+_pget = host.pmgr_p_get
+_pset = host.pmgr_p_set
+
+# set by PlayerManager.init() so that script-side team changes reach the roster
+_roster = None
+
+class PlayerSnapshot:
+	"""Per-tick table of player attributes, one column per attribute indexed by player index.
+
+	Cells are filled lazily on first read and stay valid until the generation is
+	bumped, so each attribute crosses into the engine at most once per player per tick."""
+	def __init__(self):
+		self.generation = 1
+		self.cells = {}
+		for attr in snapshotAttributes:
+			self.cells[attr] = ([None] * (MAX_PLAYER_INDEX + 1), array.array('l', [0]) * (MAX_PLAYER_INDEX + 1))
+		self.scoreCells = {}
+		for name in counterScores:
+			self.scoreCells[name] = ([0] * (MAX_PLAYER_INDEX + 1), array.array('l', [0]) * (MAX_PLAYER_INDEX + 1))
+
+	def get(self, attr, index, *args):
+		if args or not self.cells.has_key(attr):
+			return host.pmgr_p_get(attr, index, *args)
+		values, stamps = self.cells[attr]
+		if stamps[index] == self.generation:
+			return values[index]
+		value = host.pmgr_p_get(attr, index)
+		values[index] = value
+		stamps[index] = self.generation
+		return value
+
+	def set(self, attr, index, value):
+		# the engine may clamp or reject the value, so re-read it on next access
+		if self.cells.has_key(attr):
+			self.cells[attr][1][index] = 0
+		return host.pmgr_p_set(attr, index, value)
+
+	def getScore(self, index, name):
+		if not self.scoreCells.has_key(name):
+			return host.pmgr_getScore(index, name)
+		values, stamps = self.scoreCells[name]
+		if stamps[index] == self.generation:
+			return values[index]
+		value = host.pmgr_getScore(index, name)
+		values[index] = value
+		stamps[index] = self.generation
+		return value
+
+	def setScore(self, index, name, value):
+		if self.scoreCells.has_key(name):
+			self.scoreCells[name][1][index] = 0
+		return host.pmgr_setScore(index, name, value)
+
+	def invalidate(self, *args):
+		self.generation += 1
+
+
+
+class TeamRoster:
+	"""Team, alive and AI membership of all connected players, kept up to date from player events.
+
+	Reads the host directly rather than through the snapshot, as roster events
+	may be delivered before the snapshot has been invalidated for them."""
+	def __init__(self):
+		self.generation = 0
+		self.clear()
+
+	def clear(self):
+		self.generation += 1
+		self.teams = {}
+		self.members = {}
+		self.alive = {}
+		self.ai = {}
+		self.numAlive = {}
+		self.numAI = {}
+
+	def add(self, player):
+		if self.teams.has_key(player.index):
+			self._detach(player.index)
+		else:
+			self.generation += 1
+		index = player.index
+		team = host.pmgr_p_get("team", index)
+		self.teams[index] = team
+		if not self.members.has_key(team):
+			self.members[team] = {}
+			self.numAlive[team] = 0
+			self.numAI[team] = 0
+		self.members[team][index] = player
+		if host.pmgr_p_get("ai", index):
+			self.ai[index] = 1
+			self.numAI[team] += 1
+		if host.pmgr_p_get("alive", index):
+			self.alive[index] = 1
+			self.numAlive[team] += 1
+
+	def remove(self, player):
+		if not self.teams.has_key(player.index): return
+		self.generation += 1
+		self._detach(player.index)
+
+	def _detach(self, index):
+		team = self.teams[index]
+		del self.teams[index]
+		del self.members[team][index]
+		if self.ai.has_key(index):
+			del self.ai[index]
+			self.numAI[team] -= 1
+		if self.alive.has_key(index):
+			del self.alive[index]
+			self.numAlive[team] -= 1
+
+	def setAlive(self, player, alive):
+		index = player.index
+		if not self.teams.has_key(index): return
+		if alive and not self.alive.has_key(index):
+			self.alive[index] = 1
+			self.numAlive[self.teams[index]] += 1
+		elif not alive and self.alive.has_key(index):
+			del self.alive[index]
+			self.numAlive[self.teams[index]] -= 1
+
+	def update(self, player):
+		if self.teams.has_key(player.index):
+			self.add(player)
+
+	def rebuild(self, players):
+		self.clear()
+		for p in players:
+			self.add(p)
+
+	def matches(self, players):
+		if len(players) != len(self.teams): return False
+		for p in players:
+			index = p.index
+			if self.teams.get(index) != host.pmgr_p_get("team", index): return False
+			if self.alive.has_key(index) != bool(host.pmgr_p_get("alive", index)): return False
+		return True
+
+	def numInTeam(self, team):
+		if not self.members.has_key(team): return 0
+		return len(self.members[team])
+
+	def numAliveInTeam(self, team):
+		return self.numAlive.get(team, 0)
+
+	def numAIInTeam(self, team):
+		return self.numAI.get(team, 0)
+
+	def playersInTeam(self, team):
+		if not self.members.has_key(team): return []
+		return self.members[team].values()
+
+
+
 class Player:
 	def __init__(self, index):
 		self.index = index
 		self.score = PlayerScore(index)
 
 	def isValid(self): return host.pmgr_isIndexValid(self.index)
-	def isRemote(self): return host.pmgr_p_get("remote", self.index)
-	def isAIPlayer(self): return host.pmgr_p_get("ai", self.index)
-	def isAlive(self): return host.pmgr_p_get("alive", self.index)
-	def isManDown(self): return host.pmgr_p_get("mandown", self.index)
-	def isConnected(self): return host.pmgr_p_get("connected", self.index)
-	def getProfileId(self): return host.pmgr_p_get("profileid", self.index)
+	def isRemote(self): return _pget("remote", self.index)
+	def isAIPlayer(self): return _pget("ai", self.index)
+	def isAlive(self): return _pget("alive", self.index)
+	def isManDown(self): return _pget("mandown", self.index)
+	def isConnected(self): return _pget("connected", self.index)
+	def getProfileId(self): return _pget("profileid", self.index)
 
-	def isFlagHolder(self): return host.pmgr_p_get("fholder", self.index)
+	def isFlagHolder(self): return _pget("fholder", self.index)
 
-	def getTeam(self): return host.pmgr_p_get("team", self.index)
-	def setTeam(self, t): return host.pmgr_p_set("team", self.index, t)
-	def getPing(self): return host.pmgr_p_get("ping", self.index)
+	def getTeam(self): return _pget("team", self.index)
+	def setTeam(self, t):
+		result = _pset("team", self.index, t)
+		if _roster: _roster.update(self)
+		return result
+	def getPing(self): return _pget("ping", self.index)
 
-	def getSuicide(self): return host.pmgr_p_get("suicide", self.index)
-	def setSuicide(self, t): return host.pmgr_p_set("suicide", self.index, t)
+	def getSuicide(self): return _pget("suicide", self.index)
+	def setSuicide(self, t): return _pset("suicide", self.index, t)
 	
-	def getTimeToSpawn(self): return host.pmgr_p_get("tts", self.index)
-	def setTimeToSpawn(self, t): return host.pmgr_p_set("tts", self.index, t)
+	def getTimeToSpawn(self): return _pget("tts", self.index)
+	def setTimeToSpawn(self, t): return _pset("tts", self.index, t)
 
-	def getSquadId(self): return host.pmgr_p_get("sqid", self.index)
-	def isSquadLeader(self): return host.pmgr_p_get("isql", self.index)
-	def isCommander(self): return host.pmgr_p_get("commander", self.index)
+	def getSquadId(self): return _pget("sqid", self.index)
+	def isSquadLeader(self): return _pget("isql", self.index)
+	def isCommander(self): return _pget("commander", self.index)
 
-	def getName(self): return host.pmgr_p_get("name", self.index)
-	def setName(self, name): return host.pmgr_p_set("name", self.index, name)
+	def getName(self): return _pget("name", self.index)
+	def setName(self, name): return _pset("name", self.index, name)
 
-	def getSpawnGroup(self): return host.pmgr_p_get("sgr", self.index)
-	def setSpawnGroup(self, t): return host.pmgr_p_set("sgr", self.index, t)
+	def getSpawnGroup(self): return _pget("sgr", self.index)
+	def setSpawnGroup(self, t): return _pset("sgr", self.index, t)
 	
-	def getKit(self): return host.pmgr_p_get("kit", self.index)
-	def getVehicle(self): return host.pmgr_p_get("vehicle", self.index)
-	def getDefaultVehicle(self): return host.pmgr_p_get("defaultvehicle", self.index)
-	def getPrimaryWeapon(self): return host.pmgr_p_get("weapon", self.index, 0)
+	def getKit(self): return _pget("kit", self.index)
+	def getVehicle(self): return _pget("vehicle", self.index)
+	def getDefaultVehicle(self): return _pget("defaultvehicle", self.index)
+	def getPrimaryWeapon(self): return _pget("weapon", self.index, 0)
 
-	def getAddress(self): return host.pmgr_p_get("addr", self.index)
+	def getAddress(self): return _pget("addr", self.index)
 	
-	def setIsInsideCP(self, val): return host.pmgr_p_set("isInsideCP", self.index, val)
-	def getIsInsideCP(self): return host.pmgr_p_get("isInsideCP", self.index)
+	def setIsInsideCP(self, val): return _pset("isInsideCP", self.index, val)
+	def getIsInsideCP(self): return _pget("isInsideCP", self.index)
 	
 class PlayerManager:
 	def __init__(self):
 		print "PlayerManager created"
 		self._pcache = {}
+		self.snapshot = None
+		self._snapshotTimer = None
+		self.roster = None
+		self._rosterTimer = None
+		self._disconnectTimer = None
+		self._players = ()
+		self._playersGeneration = -1
+
+	# hooks up the team roster and the snapshot invalidation. until this is
+	# called the team queries fall back to scanning all players.
+	def init(self):
+		global _roster
+		if self.roster: return
+
+		# registered before any other module's handlers, so that within an event
+		# they all read fresh values once snapshots are enabled
+		for event in snapshotEvents:
+			host.registerHandler(event, self._invalidateSnapshot, 1)
+		
+		host.registerHandler('PlayerConnect', self._onRosterConnect, 1)
+		host.registerHandler('PlayerDisconnect', self._onRosterDisconnect, 1)
+		host.registerHandler('PlayerChangeTeams', self._onRosterChangeTeams, 1)
+		host.registerHandler('PlayerSpawn', self._onRosterSpawn, 1)
+		host.registerHandler('PlayerDeath', self._onRosterDeath, 1)
+		host.registerGameStatusHandler(self._onRosterGameStatusChanged)
+
+		self.roster = TeamRoster()
+		self.roster.rebuild(self._queryPlayers())
+		_roster = self.roster
+
+		self._rosterTimer = Timer(self._checkRoster, ROSTER_CHECK_INTERVAL, 1)
+		self._rosterTimer.setRecurring(ROSTER_CHECK_INTERVAL)
 		
 	def getNumberOfPlayers(self):
 		return host.pmgr_getNumberOfPlayers()
@@ -111,13 +376,33 @@ class PlayerManager:
 	def getCommander(self, team):
 		return self.getPlayerByIndex(host.pmgr_getCommander(team))
 
+	# returns an immutable tuple that is shared between callers. while the
+	# roster is hooked up it is only rebuilt when players connect or disconnect.
 	def getPlayers(self):
+		if not self.roster:
+			return self._queryPlayers()
+		if self._playersGeneration != self.roster.generation:
+			self._players = self._queryPlayers()
+			self._playersGeneration = self.roster.generation
+		return self._players
+
+	# same players as getPlayers(), without building a list when it isn't cached
+	def iterPlayers(self):
+		if self.roster and self._playersGeneration == self.roster.generation:
+			return iter(self._players)
+		return self._iterQueryPlayers()
+
+	def _queryPlayers(self):
 		indices = host.pmgr_getPlayers()
 		players = []
 		# NOTE: this uses getPlayerByIndex so we return cached player objects
 		# whenever we can
 		for i in indices: players.append(self.getPlayerByIndex(i))
-		return players
+		return tuple(players)
+
+	def _iterQueryPlayers(self):
+		for i in host.pmgr_getPlayers():
+			yield self.getPlayerByIndex(i)
 
 	def getPlayerByIndex(self, index):
 		# dep: this uses a cache so that all references to a certain player
@@ -148,16 +433,25 @@ class PlayerManager:
 		else:
 			return p
 
-	def getNumberOfPlayersInTeam(self, team):
+	def getNumberOfPlayersInTeam(self, team, exclude=None):
+		if self.roster:
+			inTeam = self.roster.numInTeam(team)
+			if exclude and self.roster.teams.get(exclude.index) == team:
+				inTeam -= 1
+			return inTeam
+
 		players = self.getPlayers()
 		inTeam = 0
 		for p in players:
-			if p.getTeam() == team:
+			if p.getTeam() == team and p != exclude:
 				inTeam += 1
 		
 		return inTeam
 		
 	def getNumberOfAlivePlayersInTeam(self, team):
+		if self.roster:
+			return self.roster.numAliveInTeam(team)
+
 		players = self.getPlayers()
 		inTeam = 0
 		for p in players:
@@ -166,8 +460,118 @@ class PlayerManager:
 		
 		return inTeam
 		
+	def getNumberOfAIPlayersInTeam(self, team):
+		if self.roster:
+			return self.roster.numAIInTeam(team)
+
+		players = self.getPlayers()
+		inTeam = 0
+		for p in players:
+			if p.getTeam() == team and p.isAIPlayer():
+				inTeam += 1
+		
+		return inTeam
+
+	def getNumberOfAIPlayers(self):
+		if self.roster:
+			return len(self.roster.ai)
+
+		numAI = 0
+		for p in self.getPlayers():
+			if p.isAIPlayer():
+				numAI += 1
+		return numAI
+
+	def getPlayersInTeam(self, team):
+		if self.roster:
+			return self.roster.playersInTeam(team)
+
+		players = []
+		for p in self.getPlayers():
+			if p.getTeam() == team:
+				players.append(p)
+		return players
+		
+	def _onRosterConnect(self, player):
+		self.roster.add(player)
+
+	def _onRosterDisconnect(self, player):
+		self.roster.remove(player)
+
+		# the host drops the player only after this event, so a handler calling
+		# getPlayers() caches them for the new generation. drop the cache again
+		# once the disconnect has completed.
+		if not self._disconnectTimer:
+			self._disconnectTimer = Timer(self._onDisconnectDone, 0, 1)
+
+	def _onDisconnectDone(self, data):
+		self._disconnectTimer.destroy()
+		self._disconnectTimer = None
+		self._playersGeneration = -1
+
+	def _onRosterChangeTeams(self, player, humanHasSpawned):
+		self.roster.update(player)
+
+	def _onRosterSpawn(self, player, soldier):
+		self.roster.setAlive(player, True)
+
+	def _onRosterDeath(self, player, vehicle):
+		self.roster.setAlive(player, False)
+
+	def _onRosterGameStatusChanged(self, status):
+		self.roster.rebuild(self._queryPlayers())
+
+	def _checkRoster(self, data):
+		players = self._queryPlayers()
+		if players != self._players:
+			self._playersGeneration = -1
+		if not self.roster.matches(players):
+			print "Team roster out of sync with host, rebuilding"
+			self.roster.rebuild(players)
+
+	# reads a set of ingame scores for several players (all by default) in one
+	# pass, returned as a dict of player index -> tuple of values
+	def readScores(self, names=counterScores, players=None):
+		if players == None: players = self.getPlayers()
+		scores = {}
+		for p in players:
+			scores[p.index] = p.score.read(names)
+		return scores
+
 	# allows temporary disabling of the onPlayerScore event.
 	def enableScoreEvents(self):
 		return host.pmgr_enableScoreEvents(1)
 	def disableScoreEvents(self):
-		return host.pmgr_enableScoreEvents(0)
\ No newline at end of file
+		return host.pmgr_enableScoreEvents(0)
+
+	# opt-in per-tick snapshot of player attributes. reads are served from a
+	# table that is dropped every engine tick and after every event that can
+	# change player state; writes go through and invalidate their cell.
+	def enableSnapshots(self):
+		global _pget, _pset, _getScore, _setScore
+		if self.snapshot: return
+		
+		self.snapshot = PlayerSnapshot()
+		_pget = self.snapshot.get
+		_pset = self.snapshot.set
+		_getScore = self.snapshot.getScore
+		_setScore = self.snapshot.setScore
+
+		self._snapshotTimer = Timer(self._invalidateSnapshot, SNAPSHOT_TICK, 1)
+		self._snapshotTimer.setRecurring(SNAPSHOT_TICK)
+		
+	def disableSnapshots(self):
+		global _pget, _pset, _getScore, _setScore
+		if not self.snapshot: return
+		
+		_pget = host.pmgr_p_get
+		_pset = host.pmgr_p_set
+		_getScore = host.pmgr_getScore
+		_setScore = host.pmgr_setScore
+		self.snapshot = None
+
+		self._snapshotTimer.destroy()
+		self._snapshotTimer = None
+
+	def _invalidateSnapshot(self, *args):
+		if self.snapshot: self.snapshot.invalidate()
@@ -0,0 +1,211 @@
+import host
+import heapq
+import time
+from bf2.Timer import Timer
+
+# number of cancelled entries tolerated in the queue before it is compacted
+COMPACT_THRESHOLD = 32
+
+class ScheduledCall:
+	"""Handle for a callback queued on a Scheduler."""
+	def __init__(self, scheduler, targetFunc, data, interval):
+		self.scheduler = scheduler
+		self.targetFunc = targetFunc
+		self.data = data
+		self.interval = interval
+		self.entry = None
+
+	def isPending(self):
+		return self.entry != None
+
+	def getTime(self):
+		if self.entry == None: return None
+		return self.entry[0]
+
+	def setRecurring(self, interval):
+		self.interval = interval
+
+	def cancel(self):
+		self.scheduler.cancel(self)
+
+	def reschedule(self, delta):
+		self.scheduler.reschedule(self, delta)
+
+
+
+class Scheduler:
+	"""Multiplexes any number of timed callbacks onto a single engine timer.
+
+	Calls are kept in a min-heap ordered by deadline, and the engine timer is only
+	ever armed for the earliest one. Scheduling and rescheduling are O(log n),
+	cancelling is O(1) (cancelled entries are skipped when they surface)."""
+	def __init__(self, alwaysTrigger=1):
+		self.alwaysTrigger = alwaysTrigger
+		self.queue = []
+		self.seq = 0
+		self.cancelled = 0
+		self.timer = None
+		self.timerTime = 0
+
+	def getNumberOfPending(self):
+		return len(self.queue) - self.cancelled
+
+	# calls targetFunc(data) in delta seconds, and then every interval seconds
+	# if interval is non-zero
+	def schedule(self, targetFunc, delta, data=None, interval=0.0):
+		call = ScheduledCall(self, targetFunc, data, interval)
+		self._push(call, host.timer_getWallTime() + delta)
+		self._arm()
+		return call
+
+	def cancel(self, call):
+		if call.entry == None: return
+		call.entry[2] = None
+		call.entry = None
+		self.cancelled += 1
+
+		if self.cancelled > COMPACT_THRESHOLD and self.cancelled * 2 > len(self.queue):
+			self.queue = [entry for entry in self.queue if entry[2] != None]
+			heapq.heapify(self.queue)
+			self.cancelled = 0
+
+	def reschedule(self, call, delta):
+		self.cancel(call)
+		self._push(call, host.timer_getWallTime() + delta)
+		self._arm()
+
+	def clear(self):
+		for entry in self.queue:
+			if entry[2]: entry[2].entry = None
+		self.queue = []
+		self.cancelled = 0
+		self._arm()
+
+	def _push(self, call, time):
+		self.seq += 1
+		entry = [time, self.seq, call]
+		call.entry = entry
+		heapq.heappush(self.queue, entry)
+
+	def _arm(self):
+		while self.queue and self.queue[0][2] == None:
+			heapq.heappop(self.queue)
+			self.cancelled -= 1
+
+		if not self.queue:
+			if self.timer:
+				self.timer.destroy()
+				self.timer = None
+			return
+
+		# an engine timer that fires before the earliest deadline is good
+		# enough, it will re-arm itself when it finds nothing due
+		time = self.queue[0][0]
+		if self.timer and self.timerTime <= time: return
+
+		if self.timer: self.timer.destroy()
+		delta = time - host.timer_getWallTime()
+		if delta < 0: delta = 0
+		self.timer = Timer(self._onTrigger, delta, self.alwaysTrigger)
+		self.timerTime = time
+
+	def _onTrigger(self, data):
+		self.timer.destroy()
+		self.timer = None
+
+		try:
+			now = host.timer_getWallTime()
+			while self.queue and self.queue[0][0] <= now:
+				entry = heapq.heappop(self.queue)
+				call = entry[2]
+				if call == None:
+					self.cancelled -= 1
+					continue
+
+				call.entry = None
+				if call.interval > 0:
+					nextTime = entry[0] + call.interval
+					if nextTime <= now: nextTime = now + call.interval
+					self._push(call, nextTime)
+
+				call.targetFunc(call.data)
+		finally:
+			self._arm()
+
+
+
+class WorkQueue:
+	"""Runs queued calls spread over several scheduler ticks, for work that can
+	wait but would stall the frame it was queued in if done at once.
+
+	Every slice runs calls until budget seconds have passed and schedules the
+	next slice interval seconds later. Once the queue drains, the time spent on
+	it is reported."""
+	def __init__(self, name, scheduler, budget, interval):
+		self.name = name
+		self.scheduler = scheduler
+		self.budget = budget
+		self.interval = interval
+		self.items = []
+		self.pos = 0
+		self.call = None
+		self.resetTimings()
+
+	def resetTimings(self):
+		self.numDone = 0
+		self.numSlices = 0
+		self.timeSpent = 0.0
+
+	def getNumberOfPending(self):
+		return len(self.items) - self.pos
+
+	# calls func(data) in a later slice
+	def add(self, func, data=None):
+		self.items.append((func, data))
+		if not self.call:
+			self.call = self.scheduler.schedule(self._onSlice, self.interval)
+
+	# runs everything still queued right away
+	def flush(self):
+		if self.getNumberOfPending():
+			self._run(None)
+
+	# drops everything still queued
+	def clear(self):
+		if self.call:
+			self.call.cancel()
+			self.call = None
+		self.items = []
+		self.pos = 0
+		self.resetTimings()
+
+	def _onSlice(self, data):
+		self.call = None
+		self._run(time.time() + self.budget)
+		if self.getNumberOfPending():
+			self.call = self.scheduler.schedule(self._onSlice, self.interval)
+
+	# runs calls until the deadline, or all of them if there is none
+	def _run(self, deadline):
+		start = time.time()
+		items = self.items
+		try:
+			while self.pos < len(items):
+				func, data = items[self.pos]
+				self.pos += 1
+				self.numDone += 1
+				func(data)
+				if deadline != None and time.time() >= deadline: break
+		finally:
+			self.numSlices += 1
+			self.timeSpent += time.time() - start
+
+		if self.pos < len(items): return
+
+		if self.call:
+			self.call.cancel()
+			self.call = None
+		print "%s: %d calls in %d slices, %.1f ms" % (self.name, self.numDone, self.numSlices, self.timeSpent * 1000)
+		self.items = []
+		self.pos = 0
+		self.resetTimings()
@@ -16,6 +16,7 @@ objectManager = None
 triggerManager = None
 gameLogic = None
 serverSettings = None
+scheduler = None
 
 g_debug = 0
 
@@ -25,11 +26,13 @@ import bf2.PlayerManager
 import bf2.ObjectManager
 import bf2.TriggerManager
 import bf2.GameLogic
+import bf2.Scheduler
 playerManager = bf2.PlayerManager.PlayerManager()
 objectManager = bf2.ObjectManager.ObjectManager()
 triggerManager = bf2.TriggerManager.TriggerManager()
 gameLogic = bf2.GameLogic.GameLogic()
 serverSettings = bf2.GameLogic.ServerSettings()
+scheduler = bf2.Scheduler.Scheduler()
 
 # these are for wrapping purposes when converting c++ pointers into python objects
 playerConvFunc = playerManager.getPlayerByIndex
@@ -72,9 +75,19 @@ def init_module():
 	sys.stdout = fake_stream('stdout')
 	sys.stderr = fake_stream('stderr')
 
+	playerManager.init()
+	objectManager.init()
+
 	import game.scoringCommon
 	game.scoringCommon.init()
 	
+	try:
+		import bf2.stats.typetables
+	except ImportError:
+		print "Stat type tables module not found."
+	else:
+		bf2.stats.typetables.init()
+
 	try:
 		import bf2.stats.stats
 	except ImportError:
@@ -92,6 +105,13 @@ def init_module():
 
 	if not gameLogic.isAIGame():
 	
+		try:
+			import bf2.stats.journal
+		except ImportError:
+			print "Stats journal module not found."
+		else:
+			bf2.stats.journal.init()
+
 		try:
 			import bf2.stats.snapshot
 		except ImportError:
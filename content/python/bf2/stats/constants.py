@@ -2,6 +2,8 @@
 
 import host
 import string
+import fnmatch
+import bf2
 from bf2 import g_debug
 
 
@@ -421,53 +423,102 @@ UNKNOWN_GAMEMODE = 99
 
 
 
-def getVehicleType(templateName):
+# pattern rules installed by bf2.stats.typetables, consulted for names missing
+# from the exact maps above. each rule is (RULE_*, text, value), first match wins.
+RULE_PREFIX	= 0
+RULE_SUFFIX	= 1
+RULE_CONTAINS	= 2
+RULE_GLOB	= 3
+
+vehicleTypeRules = []
+weaponTypeRules = []
+kitTypeRules = []
+armyRules = []
+mapRules = []
+
+
+
+def matchTypeRules(rules, key, default):
+	for rule, text, value in rules:
+		if rule == RULE_PREFIX:
+			if key.startswith(text): return value
+		elif rule == RULE_SUFFIX:
+			if key.endswith(text): return value
+		elif rule == RULE_CONTAINS:
+			if key.find(text) != -1: return value
+		elif fnmatch.fnmatchcase(key, text):
+			return value
+	return default
+
+
+
+def lookupType(typeMap, rules, key, default):
+	if typeMap.has_key(key):
+		return typeMap[key]
+	if rules:
+		return matchTypeRules(rules, key, default)
+	return default
+
+
+
+# templateName -> (vehicleType, weaponType, kitType). misses are cached as
+# the *_UNKNOWN types, so every template name is only lowercased and looked up once.
+templateTypeCache = {}
+
+def classifyTemplate(templateName):
 	try:
-		vehicleType = vehicleTypeMap[string.lower(templateName)]
+		return templateTypeCache[templateName]
 	except KeyError:
-		return VEHICLE_TYPE_UNKNOWN
-	
-	return vehicleType
+		pass
+
+	key = string.lower(templateName)
+	types = (lookupType(vehicleTypeMap, vehicleTypeRules, key, VEHICLE_TYPE_UNKNOWN),
+		lookupType(weaponTypeMap, weaponTypeRules, key, WEAPON_TYPE_UNKNOWN),
+		lookupType(kitTypeMap, kitTypeRules, key, KIT_TYPE_UNKNOWN))
+	templateTypeCache[intern(templateName)] = types
+	return types
+
+
+
+def classifyTemplates(templateNames):
+	cache = templateTypeCache
+	res = []
+	for templateName in templateNames:
+		if templateName in cache:
+			res.append(cache[templateName])
+		else:
+			res.append(classifyTemplate(templateName))
+	return res
+
+
+
+def clearTemplateTypeCache():
+	templateTypeCache.clear()
+
+
+
+def getVehicleType(templateName):
+	return classifyTemplate(templateName)[0]
 
 
 	
 def getWeaponType(templateName):
-	try:
-		weaponType = weaponTypeMap[string.lower(templateName)]
-	except KeyError:
-		return WEAPON_TYPE_UNKNOWN
-	
-	return weaponType	
+	return classifyTemplate(templateName)[1]
 	
 	
 	
 def getKitType(templateName):	
-	try:
-		kitType = kitTypeMap[string.lower(templateName)]
-	except KeyError:
-		return KIT_TYPE_UNKNOWN
-	
-	return kitType	
+	return classifyTemplate(templateName)[2]
 	
 	
 	
 def getArmy(templateName):
-	try:
-		army = armyMap[string.lower(templateName)]
-	except KeyError:
-		return ARMY_UNKNOWN
-	
-	return army
+	return lookupType(armyMap, armyRules, string.lower(templateName), ARMY_UNKNOWN)
 
 
 
 def getMapId(mapName):
-	try:
-		mapId = mapMap[string.lower(mapName)]
-	except KeyError:
-		return UNKNOWN_MAP
-	
-	return mapId
+	return lookupType(mapMap, mapRules, string.lower(mapName), UNKNOWN_MAP)
 
 
 
@@ -482,12 +533,7 @@ def getGameModeId(gameMode):
 
 
 def getRootParent(obj):
-	parent = obj.getParent()
-	
-	if parent == None:
-		return obj
-		
-	return getRootParent(parent)
+	return bf2.objectManager.getRootParent(obj)
 
 
 
@@ -1,9 +1,10 @@
 import host
+import operator
 import bf2.PlayerManager
 import bf2.GameLogic
 from constants import *
 from bf2 import g_debug
-from bf2.stats.stats import getStatsMap
+from bf2.stats.stats import getStatsMap, getSessionStore
 
 
 
@@ -19,58 +20,64 @@ def invoke():
 	e = {}
 	
 	statsMap = getStatsMap()
+	store = getSessionStore()
+
+	# rankings are taken over whole store columns, gathered for the players
+	# in the stats map. ties go to the player that connected first.
+	players = statsMap.values()
+	rows = [sp.row for sp in players]
+	names = [sp.name for sp in players]
+	order = [-row for row in rows]
+
+	gather = store.gather
 	
-	# find top player in different categories
-	for sp in statsMap.itervalues():
-		for k in range(0, NUM_KIT_TYPES + 1):
-			if k in sp.kits and sp.kits[k].timeInObject > 0:
-				findTop(e, "sk" + str(k), "skn" + str(k), sp.kits[k].score, sp.name)
+	# find top player in different categories. all players have been
+	# finalized at this point, so their object times are complete.
+	for k in range(0, store.getNumTypes('kits')):
+		findTop(e, "sk" + str(k), "skn" + str(k), store.gatherType('kits', 'score', k, rows), order, names,
+			store.gatherType('kits', 'rawTimeInObject', k, rows))
 
-		for v in range(0, NUM_VEHICLE_TYPES + 1):
-			if v in sp.vehicles and sp.vehicles[v].timeInObject > 0:
-				findTop(e, "sv" + str(v), "svn" + str(v), sp.vehicles[v].score, sp.name)
-
-		findTop(e, "ts", "tsn", sp.teamScore, sp.name)
-		findTop(e, "ss", "ssn", sp.skillScore, sp.name)
-		findTop(e, "cpc", "cpcn", sp.localScore.cpCaptures, sp.name)
-		findTop(e, "cpa", "cpan", sp.localScore.cpAssists, sp.name)
-		findTop(e, "cpd", "cpdn", sp.localScore.cpDefends, sp.name)
-		findTop(e, "ka", "kan", sp.localScore.damageAssists + sp.localScore.targetAssists + sp.localScore.passengerAssists, sp.name)
-		findTop(e, "he", "hen", sp.localScore.heals, sp.name)
-		findTop(e, "rev", "revn", sp.localScore.revives, sp.name)
-		findTop(e, "rsp", "rspn", sp.localScore.ammos, sp.name)
-		findTop(e, "rep", "repn", sp.localScore.repairs, sp.name)
-		findTop(e, "drs", "drsn", sp.localScore.driverSpecials + sp.localScore.driverAssists, sp.name)
+	for v in range(0, store.getNumTypes('vehicles')):
+		findTop(e, "sv" + str(v), "svn" + str(v), store.gatherType('vehicles', 'score', v, rows), order, names,
+			store.gatherType('vehicles', 'rawTimeInObject', v, rows))
+
+	findTop(e, "ts", "tsn", gather('teamScore', rows), order, names)
+	findTop(e, "ss", "ssn", gather('skillScore', rows), order, names)
+	findTop(e, "cpc", "cpcn", gather('cpCaptures', rows), order, names)
+	findTop(e, "cpa", "cpan", gather('cpAssists', rows), order, names)
+	findTop(e, "cpd", "cpdn", gather('cpDefends', rows), order, names)
+	findTop(e, "ka", "kan", map(sum3, gather('damageAssists', rows), gather('targetAssists', rows), gather('passengerAssists', rows)), order, names)
+	findTop(e, "he", "hen", gather('heals', rows), order, names)
+	findTop(e, "rev", "revn", gather('revives', rows), order, names)
+	findTop(e, "rsp", "rspn", gather('ammos', rows), order, names)
+	findTop(e, "rep", "repn", gather('repairs', rows), order, names)
+	findTop(e, "drs", "drsn", map(operator.add, gather('driverSpecials', rows), gather('driverAssists', rows)), order, names)
 		
 	
 	# find top-3
-	if len(statsMap) > 0:
-		sortedPlayers = []
-		for sp in statsMap.itervalues():
-			sortedPlayers += [((sp.score, sp.skillScore, -sp.deaths), sp)]
-	
-		sortedPlayers.sort()
-		sortedPlayers.reverse()
-		
+	ranking = zip(gather('score', rows), gather('skillScore', rows), map(operator.neg, gather('deaths', rows)), order, players)
+	for i in range(3):
+		if not ranking:
+			break
+
+		best = max(ranking)
+		ranking.remove(best)
+
 		# stats for top-3 scoring players
-		for i in range(3):
-			if len(sortedPlayers) <= i:
-				break
-	
-			sp = sortedPlayers[i][1]
-			e["np" + str(i)] = sp.name
-			e["tsp" + str(i)] = sp.teamScore
-			e["ssp" + str(i)] = sp.skillScore
-			e["csp" + str(i)] = sp.cmdScore
-			e["bfp" + str(i)] = sp.bulletsFired
-			e["bhp" + str(i)] = sp.bulletsHit
-			for k in range(0, NUM_KIT_TYPES + 1):
-				if sp.kits[k].timeInObject > 0:
-					e["tk" + str(k) + "p" + str(i)] = int(sp.kits[k].timeInObject)
-					
-			for v in range(0, NUM_VEHICLE_TYPES + 1):
-				if sp.vehicles[v].timeInObject > 0:
-					e["tv" + str(v) + "p" + str(i)] = int(sp.vehicles[v].timeInObject)
+		sp = best[-1]
+		e["np" + str(i)] = sp.name
+		e["tsp" + str(i)] = sp.teamScore
+		e["ssp" + str(i)] = sp.skillScore
+		e["csp" + str(i)] = sp.cmdScore
+		e["bfp" + str(i)] = sp.bulletsFired
+		e["bhp" + str(i)] = sp.bulletsHit
+		for k in range(0, NUM_KIT_TYPES + 1):
+			if sp.kits[k].timeInObject > 0:
+				e["tk" + str(k) + "p" + str(i)] = int(sp.kits[k].timeInObject)
+				
+		for v in range(0, NUM_VEHICLE_TYPES + 1):
+			if sp.vehicles[v].timeInObject > 0:
+				e["tv" + str(v) + "p" + str(i)] = int(sp.vehicles[v].timeInObject)
 		
 	keyvals = []
 	for k in e:
@@ -83,9 +90,19 @@ def invoke():
 
 	
 		
-def findTop(e, vkey, nkey, value, name):
-	if not vkey in e or value > e[vkey]:
-		e[vkey] = value
-		e[nkey] = name
-	
-		
\ No newline at end of file
+# sets e[vkey] and e[nkey] to the highest of values and the name of its
+# player. only players with a non-zero mask entry are considered.
+def findTop(e, vkey, nkey, values, order, names, mask=None):
+	candidates = zip(values, order, names)
+	if mask != None:
+		candidates = [c for c, m in zip(candidates, mask) if m > 0]
+	if not candidates: return
+
+	value, o, name = max(candidates)
+	e[vkey] = value
+	e[nkey] = name
+
+
+
+def sum3(a, b, c):
+	return a + b + c
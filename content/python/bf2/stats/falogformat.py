@@ -0,0 +1,374 @@
+# fragalyzer log record formats.
+#
+# the records of the fragalyzer log are described once in recordTypes, and
+# written either as the classic text lines or in a compact binary format:
+#
+#   header	magic "FALB" and format version (uint16)
+#   string	kind 0, string id (uint16), length (uint16) and the bytes
+#   record	kind 1.., followed by the fixed width fields of its type
+#
+# names and templates are interned: a string record defines an id before the
+# first record using it. ints are int32, positions three int32 in thousandths
+# and times with one decimal an int32 in tenths. missing fields hold NONE_INT
+# or NONE_STRING.
+#
+# this module doesnt need the game, run it standalone to convert a binary log
+# to text:
+#   python falogformat.py <binary log> [<text log>]
+#
+# or to time the position formatting against the fpformat based one:
+#   python falogformat.py -bench [<number of positions>]
+
+import sys
+import time
+import struct
+import fpformat
+
+MAGIC = "FALB"
+FORMAT_VERSION = 1
+HEADER = "<4sH"
+STRING_HEADER = "<BHH"
+
+KIND_STRING = 0
+
+NONE_INT = -2147483648
+NONE_STRING = 0xffff
+
+# field kinds
+STR = 0
+INT = 1
+POS = 2
+TENTHS = 3
+
+fieldCodes = { STR : "H", INT : "i", POS : "iii", TENTHS : "i" }
+
+# record name and its fields in text order. fields that are None are left out
+# of text lines.
+recordTypes = (
+	("INIT",	(("LevelName", STR), ("StartTime", INT), ("StartDate", STR), ("Filename", STR))),
+	("DISABLE",	(("LevelName", STR), ("EndTime", INT))),
+	("ENTER",	(("PlayerName", STR), ("PlayerTeam", INT), ("VehicleName", STR), ("Time", INT))),
+	("EXIT",	(("PlayerName", STR), ("PlayerTeam", INT), ("VehicleName", STR), ("VehicleTime", TENTHS), ("Time", INT))),
+	("PICKUPKIT",	(("PlayerName", STR), ("PlayerTeam", INT), ("PlayerKit", STR), ("PickupSpawnDiff", INT), ("Time", INT))),
+	("DROPKIT",	(("PlayerName", STR), ("PlayerTeam", INT), ("PlayerKit", STR), ("PlayerKitTime", TENTHS), ("Time", INT))),
+	("KILL",	(("AttackerName", STR), ("AttackerTeam", INT), ("AttackerPos", POS),
+			 ("VictimName", STR), ("VictimTeam", INT), ("VictimPos", POS), ("VictimKit", STR), ("VictimVehicle", STR),
+			 ("AttackerKit", STR), ("AttackerVehicle", STR), ("AttackerWeapon", STR), ("Time", INT))),
+	("FIRED",	(("PlayerName", STR), ("Weapon", STR), ("ShotsFired", INT), ("ShotsHit", INT), ("Time", INT))),
+	("CAPTURE",	(("ControlPointID", STR), ("CaptureType", STR), ("CaptureTeam", INT), ("CapturePointPos", POS), ("Time", INT))),
+	("SCORE",	(("ScoreDiff", INT), ("PlayerName", STR), ("PlayerTeam", INT), ("PlayerKit", STR), ("PlayerVehicle", STR),
+			 ("PlayerPos", POS), ("Time", INT), ("Scoretype", STR))),
+	("GRAPPLE",	(("Name", STR), ("Team", INT), ("Pos", POS))),
+	("ZIPLINE",	(("Name", STR), ("Team", INT), ("Pos", POS))),
+	("TACTICAL",	(("Name", STR), ("Team", INT), ("Pos", POS))),
+)
+
+# record name -> (kind, fields, struct format)
+recordInfo = {}
+# kind -> (name, fields, struct format, size)
+recordKinds = {}
+for i in range(len(recordTypes)):
+	name, fields = recordTypes[i]
+	format = "<B" + "".join([fieldCodes[kind] for key, kind in fields])
+	recordInfo[name] = (i + 1, fields, format)
+	recordKinds[i + 1] = (name, fields, format, struct.calcsize(format))
+del i, name, fields, format
+
+
+
+# values are rounded half away from zero, like fpformat.fix does on their
+# decimal text. the bias makes up for products like 149.7625 * 1000 falling
+# just short of the half.
+ROUND_BIAS = 0.5000001
+
+def quantize(value, scale):
+	if value < 0: return -int(-value * scale + ROUND_BIAS)
+	return int(value * scale + ROUND_BIAS)
+
+# fixed-point text of a value with three decimals, same as fpformat.fix(value,
+# 3) without going through the decimal text of the float
+def fix3(value):
+	if value < 0 or (not value and str(value)[0] == "-"):
+		q = int(-value * 1000 + ROUND_BIAS)
+		return "-%d.%03d" % (q / 1000, q % 1000)
+	q = int(value * 1000 + ROUND_BIAS)
+	return "%d.%03d" % (q / 1000, q % 1000)
+
+def fix1(value):
+	if value < 0 or (not value and str(value)[0] == "-"):
+		q = int(-value * 10 + ROUND_BIAS)
+		return "-%d.%d" % (q / 10, q % 10)
+	q = int(value * 10 + ROUND_BIAS)
+	return "%d.%d" % (q / 10, q % 10)
+
+def posStr(pos):
+	return fix3(pos[0]) + "," + fix3(pos[1]) + "," + fix3(pos[2])
+
+textFormatters = {
+	STR	: str,
+	INT	: str,
+	POS	: posStr,
+	TENTHS	: fix1,
+}
+
+
+
+class TextEncoder:
+	"""Writes records as text lines to out."""
+	def __init__(self, out):
+		self.out = out
+
+	def write(self, name, values):
+		kind, fields, format = recordInfo[name]
+		line = [name]
+		for i in range(len(fields)):
+			value = values[i]
+			if value == None: continue
+			key, fieldKind = fields[i]
+			line.append(" " + key + "=" + textFormatters[fieldKind](value))
+		line.append("\n")
+		self.out.write("".join(line))
+
+
+
+class BinaryEncoder:
+	"""Writes records in the binary format to out."""
+	def __init__(self, out):
+		self.out = out
+		self.strings = {}
+		out.write(struct.pack(HEADER, MAGIC, FORMAT_VERSION))
+
+	def write(self, name, values):
+		kind, fields, format = recordInfo[name]
+		data = []
+		args = [kind]
+		for i in range(len(fields)):
+			value = values[i]
+			fieldKind = fields[i][1]
+			if fieldKind == STR:
+				if value == None:
+					args.append(NONE_STRING)
+				else:
+					args.append(self.intern(str(value), data))
+			elif fieldKind == POS:
+				if value == None:
+					args.extend((NONE_INT, NONE_INT, NONE_INT))
+				else:
+					args.extend((quantize(value[0], 1000), quantize(value[1], 1000), quantize(value[2], 1000)))
+			elif value == None:
+				args.append(NONE_INT)
+			elif fieldKind == TENTHS:
+				args.append(quantize(value, 10))
+			else:
+				args.append(int(value))
+		data.append(struct.pack(format, *args))
+		self.out.write("".join(data))
+
+	# id of a string, a definition is added to data when it is new
+	def intern(self, value, data):
+		id = self.strings.get(value)
+		if id == None:
+			id = len(self.strings)
+			if id == NONE_STRING: raise ValueError, "fragalyzer log string table full"
+			self.strings[value] = id
+			data.append(struct.pack(STRING_HEADER, KIND_STRING, id, len(value)) + value)
+		return id
+
+
+
+# yields the (name, values) of every record in a binary log, reading f as it
+# goes. values are in the form the encoders take.
+def readRecords(f):
+	magic, version = struct.unpack(HEADER, f.read(struct.calcsize(HEADER)))
+	if magic != MAGIC or version != FORMAT_VERSION:
+		raise ValueError, "not a fragalyzer binary log"
+
+	strings = {}
+	stringHeaderSize = struct.calcsize(STRING_HEADER)
+	while 1:
+		kind = f.read(1)
+		if not kind: return
+		kind = ord(kind)
+
+		if kind == KIND_STRING:
+			data = f.read(stringHeaderSize - 1)
+			if len(data) < stringHeaderSize - 1: return
+			k, id, length = struct.unpack(STRING_HEADER, chr(kind) + data)
+			value = f.read(length)
+			if len(value) < length: return
+			strings[id] = value
+			continue
+
+		if not kind in recordKinds:
+			raise ValueError, "unknown fragalyzer record kind %d" % kind
+		name, fields, format, size = recordKinds[kind]
+		data = f.read(size - 1)
+		# a record cut short at the end of the log is dropped
+		if len(data) < size - 1: return
+		args = struct.unpack(format, chr(kind) + data)
+
+		values = []
+		i = 1
+		for key, fieldKind in fields:
+			if fieldKind == STR:
+				if args[i] == NONE_STRING:
+					values.append(None)
+				else:
+					values.append(strings[args[i]])
+				i += 1
+			elif fieldKind == POS:
+				if args[i] == NONE_INT:
+					values.append(None)
+				else:
+					values.append((args[i] / 1000.0, args[i + 1] / 1000.0, args[i + 2] / 1000.0))
+				i += 3
+			else:
+				if args[i] == NONE_INT:
+					values.append(None)
+				elif fieldKind == TENTHS:
+					values.append(args[i] / 10.0)
+				else:
+					values.append(args[i])
+				i += 1
+
+		yield name, values
+
+
+
+# value of a text field, None if it cant be read
+def parseValue(fieldKind, text):
+	try:
+		if fieldKind == STR:
+			return text
+		elif fieldKind == POS:
+			x, y, z = text.split(",")
+			return (float(x), float(y), float(z))
+		elif fieldKind == TENTHS:
+			return float(text)
+		else:
+			try:
+				return int(text)
+			except ValueError:
+				return int(float(text))
+	except ValueError:
+		return None
+
+# (name, values) of a text line, None for lines of unknown records. fields
+# are found by their keys in field order, so values may contain spaces.
+def parseLine(line):
+	line = line.rstrip("\r\n")
+	name = line.split(" ", 1)[0]
+	info = recordInfo.get(name)
+	if not info: return None
+	fields = info[1]
+
+	# (field nr, start of " key=", start of value) of the fields present
+	found = []
+	pos = len(name)
+	for i in range(len(fields)):
+		key = fields[i][0]
+		start = line.find(" " + key + "=", pos)
+		if start < 0: continue
+		pos = start + len(key) + 2
+		found.append((i, start, pos))
+
+	values = [None] * len(fields)
+	for n in range(len(found)):
+		i, start, valueStart = found[n]
+		if n + 1 < len(found):
+			end = found[n + 1][1]
+		else:
+			end = len(line)
+		values[i] = parseValue(fields[i][1], line[valueStart:end])
+	return name, values
+
+# yields the (name, values) of every record in a text log, like readRecords
+def readTextRecords(f):
+	while 1:
+		line = f.readline()
+		if not line: return
+		record = parseLine(line)
+		if record: yield record
+
+
+
+# converts a binary log to text
+def convert(inFile, outFile):
+	encoder = TextEncoder(outFile)
+	numRecords = 0
+	for name, values in readRecords(inFile):
+		encoder.write(name, values)
+		numRecords += 1
+	return numRecords
+
+
+
+# times the position formatting of numPositions random positions against
+# the fpformat based formatting it replaced
+def benchmark(numPositions):
+	import random
+
+	def getWorldSize():
+		return (1024.0, 1024.0)
+
+	# as the fragalyzer log did it before positions were cached and formatted
+	# in fixed point
+	def oldPosStr(orgPos):
+		worldSize = getWorldSize();
+		scale = [512.0 / worldSize[0], 1, 512.0 / worldSize[1]]
+		pos = [orgPos[0] * scale[0], orgPos[1] * scale[1], orgPos[2] * scale[2]]
+		return str(fpformat.fix(pos[0], 3)) + "," + str(fpformat.fix(pos[1], 3)) + "," + str(fpformat.fix(pos[2], 3))
+
+	scaleX, scaleZ = 512.0 / 1024.0, 512.0 / 1024.0
+	def newPosStr(orgPos):
+		return posStr((orgPos[0] * scaleX, orgPos[1], orgPos[2] * scaleZ))
+
+	positions = [(random.uniform(-1024, 1024), random.uniform(0, 300), random.uniform(-1024, 1024)) for i in range(numPositions)]
+	# engine positions are floats, so grid values with exact halves are common
+	positions.extend([(int(x * 16) / 16.0, int(y * 16) / 16.0, int(z * 16) / 16.0) for x, y, z in positions[:numPositions / 4]])
+
+	results = []
+	for name, func in (("fpformat", oldPosStr), ("fixed point", newPosStr)):
+		start = time.time()
+		results.append(map(func, positions))
+		elapsed = time.time() - start
+		print "%-12s %8.1f ms, %6.2f us per position" % (name, elapsed * 1000, elapsed * 1000000 / len(positions))
+
+	numDiffering = len([1 for old, new in zip(results[0], results[1]) if old != new])
+	print "%d of %d positions formatted differently" % (numDiffering, len(positions))
+	return numDiffering
+
+
+
+def main(args):
+	if len(args) < 1:
+		print "usage: falogformat.py <binary log> [<text log>]"
+		print "       falogformat.py -bench [<number of positions>]"
+		return 1
+
+	if args[0] == "-bench":
+		numPositions = 100000
+		if len(args) > 1: numPositions = int(args[1])
+		benchmark(numPositions)
+		return 0
+
+	# closed segments are gzipped, see bf2.stats.logrotate
+	if args[0][-3:] == ".gz":
+		import gzip
+		inFile = gzip.open(args[0], "rb")
+	else:
+		inFile = open(args[0], "rb")
+	if len(args) > 1:
+		outFile = open(args[1], "w")
+	else:
+		outFile = sys.stdout
+
+	try:
+		convert(inFile, outFile)
+	finally:
+		inFile.close()
+		if len(args) > 1: outFile.close()
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
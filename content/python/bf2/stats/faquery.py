@@ -0,0 +1,461 @@
+# fragalyzer log query tool.
+#
+# ingests fragalyzer logs, text or binary, plain or gzipped segments, into a
+# local store with one file per round, and answers queries from it without
+# reparsing the logs. every round is indexed by
+#
+#   event	record name, KILL, SCORE, CAPTURE, FIRED...
+#   player	the player names of the record
+#   weapon	the weapons of the record
+#   cell	the grid cells of the record's positions
+#
+# the grid divides the 512x512 fragalyzer map space, -256 to 256 on both axes,
+# into GRID_SIZE x GRID_SIZE cells, given as x,z with 0,0 at the lowest
+# corner. positions outside the map go to the nearest cell.
+#
+# the store catalog keeps the keys found in every round, so rounds that cant
+# match are not even loaded. it runs without the game:
+#
+#   python faquery.py [-s <store>] ingest <log dir or file>...
+#   python faquery.py [-s <store>] rounds
+#   python faquery.py [-s <store>] query [-e KILL] [-w <weapon>] [-c 3,7] [-r 200]
+#   python faquery.py [-s <store>] query -e KILL -n cell
+#
+# logs of a round that is still running can be ingested again later, rounds
+# whose segments havent changed are skipped.
+
+import os
+import re
+import sys
+import time
+import marshal
+import optparse
+from falogformat import recordTypes, POS, TextEncoder, readRecords, readTextRecords
+from logrotate import SegmentIndex, openSegment
+
+STORE_VERSION = 1
+CATALOG_NAME = "catalog.dat"
+ROUND_EXTENSION = ".idx"
+DEFAULT_STORE = "faStore"
+
+# index written next to rotated segments by fragalyzer_log
+INDEX_NAME = "faLog_index.txt"
+
+GRID_SIZE = 16
+CELL_SIZE = 512.0 / GRID_SIZE
+
+indexKinds = ("event", "player", "weapon", "cell")
+
+playerKeys = ("PlayerName", "AttackerName", "VictimName", "Name")
+weaponKeys = ("Weapon", "AttackerWeapon")
+
+# segments of a round: <base>.txt, then <base>_1.txt and so on, .dat for binary
+# logs and .gz once compressed
+segmentPattern = re.compile(r"^(.*_faLog)(_(\d+))?\.(txt|dat)(\.gz)?$")
+
+# record name -> field nrs of its players, weapons and positions
+recordKeyFields = {}
+# record name -> field keys
+recordFieldKeys = {}
+for name, fields in recordTypes:
+	recordFieldKeys[name] = [key for key, fieldKind in fields]
+	players = []
+	weapons = []
+	positions = []
+	for i in range(len(fields)):
+		key, fieldKind = fields[i]
+		if fieldKind == POS:
+			positions.append(i)
+		elif key in playerKeys:
+			players.append(i)
+		elif key in weaponKeys:
+			weapons.append(i)
+	recordKeyFields[name] = (players, weapons, positions)
+del name, fields, players, weapons, positions
+
+
+
+def getCell(pos):
+	x = int((pos[0] + 256.0) / CELL_SIZE)
+	z = int((pos[2] + 256.0) / CELL_SIZE)
+	return (min(max(x, 0), GRID_SIZE - 1), min(max(z, 0), GRID_SIZE - 1))
+
+def parseCell(text):
+	x, z = text.split(",")
+	return (int(x), int(z))
+
+def cellStr(cell):
+	return "%d,%d" % cell
+
+
+
+# keys of a record for an index kind. posField limits cells to the position
+# field with that name.
+def getKeys(kind, name, values, posField=None):
+	if kind == "event":
+		return [name]
+
+	players, weapons, positions = recordKeyFields[name]
+	if kind == "player":
+		fieldNrs = players
+	elif kind == "weapon":
+		fieldNrs = weapons
+	else:
+		fieldNrs = positions
+
+	keys = []
+	for i in fieldNrs:
+		value = values[i]
+		if value == None: continue
+		if kind == "cell":
+			if posField and recordFieldKeys[name][i] != posField: continue
+			value = getCell(value)
+		if not value in keys:
+			keys.append(value)
+	return keys
+
+
+
+class Round:
+	"""Records of a round and their indexes, kind -> key -> record nrs."""
+	def __init__(self, records=None, indexes=None):
+		if records == None: records = []
+		if indexes == None:
+			indexes = {}
+			for kind in indexKinds:
+				indexes[kind] = {}
+		self.records = records
+		self.indexes = indexes
+
+	def add(self, name, values):
+		nr = len(self.records)
+		self.records.append((name, values))
+		for kind in indexKinds:
+			index = self.indexes[kind]
+			for key in getKeys(kind, name, values):
+				index.setdefault(key, []).append(nr)
+
+	# number of records per key, as kept in the catalog
+	def getSummary(self):
+		summary = {}
+		for kind in indexKinds:
+			counts = {}
+			for key, nrs in self.indexes[kind].iteritems():
+				counts[key] = len(nrs)
+			summary[kind] = counts
+		return summary
+
+	# record nrs having all the keys in terms, a list of (kind, key)
+	def find(self, terms):
+		if not terms:
+			return range(len(self.records))
+
+		lists = []
+		for kind, key in terms:
+			nrs = self.indexes[kind].get(key)
+			if not nrs: return []
+			lists.append(nrs)
+
+		# walk the shortest list, look up the rest
+		lists.sort(lambda a, b: cmp(len(a), len(b)))
+		result = lists[0]
+		for nrs in lists[1:]:
+			found = {}
+			for nr in nrs:
+				found[nr] = 1
+			result = [nr for nr in result if nr in found]
+			if not result: break
+		return result
+
+
+
+class Store:
+	"""Directory of indexed rounds. The catalog maps round names to
+	(map, started at, sources, number of records, summary)."""
+	def __init__(self, path):
+		self.path = path
+		self.rounds = {}
+		self.load()
+
+	def getCatalogPath(self):
+		return os.path.join(self.path, CATALOG_NAME)
+
+	def getRoundPath(self, roundName):
+		return os.path.join(self.path, roundName + ROUND_EXTENSION)
+
+	def load(self):
+		try:
+			f = open(self.getCatalogPath(), "rb")
+		except IOError:
+			return
+		try:
+			try:
+				version, rounds = marshal.load(f)
+			except (EOFError, ValueError, TypeError):
+				print "Ignored unreadable store catalog"
+				return
+		finally:
+			f.close()
+		if version == STORE_VERSION:
+			self.rounds = rounds
+
+	def save(self):
+		writeFile(self.getCatalogPath(), (STORE_VERSION, self.rounds))
+
+	def isCurrent(self, roundName, sources):
+		entry = self.rounds.get(roundName)
+		return entry != None and entry[2] == sources
+
+	def addRound(self, roundName, mapName, startedAt, sources, round):
+		writeFile(self.getRoundPath(roundName), (STORE_VERSION, round.records, round.indexes))
+		self.rounds[roundName] = (mapName, startedAt, sources, len(round.records), round.getSummary())
+
+	def loadRound(self, roundName):
+		f = open(self.getRoundPath(roundName), "rb")
+		try:
+			version, records, indexes = marshal.load(f)
+		finally:
+			f.close()
+		return Round(records, indexes)
+
+	# names of the last numRounds rounds, oldest first, optionally of one map
+	def getRoundNames(self, numRounds=0, mapName=None):
+		rounds = [(entry[1], roundName) for roundName, entry in self.rounds.iteritems()
+				if mapName == None or entry[0] == mapName]
+		rounds.sort()
+		if numRounds:
+			rounds = rounds[-numRounds:]
+		return [roundName for startedAt, roundName in rounds]
+
+	# yields (round name, name, values) of the records having all terms
+	def query(self, terms, numRounds=0, mapName=None):
+		for roundName in self.getRoundNames(numRounds, mapName):
+			summary = self.rounds[roundName][4]
+			skip = False
+			for kind, key in terms:
+				if not key in summary[kind]:
+					skip = True
+					break
+			if skip: continue
+
+			round = self.loadRound(roundName)
+			for nr in round.find(terms):
+				name, values = round.records[nr]
+				yield roundName, name, values
+
+
+
+# marshals data to path, replacing it only once written
+def writeFile(path, data):
+	f = open(path + ".tmp", "wb")
+	try:
+		marshal.dump(data, f)
+	finally:
+		f.close()
+
+	# rename wont replace an existing file on all platforms
+	if os.path.exists(path):
+		os.remove(path)
+	os.rename(path + ".tmp", path)
+
+
+
+# the logs in paths grouped into rounds, round name -> [(segment nr, path)].
+# files are grouped with the other segments of their round in their directory.
+def findRounds(paths):
+	# dir -> names of the rounds wanted from it, None for all
+	dirs = {}
+	for path in paths:
+		if os.path.isdir(path):
+			dirs[path] = None
+			continue
+		match = segmentPattern.match(os.path.basename(path))
+		if not match:
+			print "Not a fragalyzer log: ", path
+			continue
+		dir = os.path.dirname(path) or "."
+		wanted = dirs.setdefault(dir, {})
+		if wanted != None: wanted[match.group(1)] = 1
+
+	rounds = {}
+	for dir, wanted in dirs.items():
+		for fileName in os.listdir(dir):
+			match = segmentPattern.match(fileName)
+			if not match: continue
+			roundName = match.group(1)
+			if wanted != None and not roundName in wanted: continue
+			segmentNr = int(match.group(3) or 0)
+
+			# a segment caught while being compressed shows up twice, the
+			# compressed one is complete
+			segments = rounds.setdefault(roundName, {})
+			if segments.has_key(segmentNr) and not match.group(5): continue
+			segments[segmentNr] = os.path.join(dir, fileName)
+
+	for roundName, segments in rounds.items():
+		segmentNrs = segments.keys()
+		segmentNrs.sort()
+		rounds[roundName] = [(nr, segments[nr]) for nr in segmentNrs]
+	return rounds
+
+
+
+# file name -> (map, round) of the segments in the index of dir
+def readSegmentIndex(dir):
+	entries = {}
+	for mapName, round, segmentNr, path, size, closedAt in SegmentIndex(os.path.join(dir, INDEX_NAME)).read():
+		entries[os.path.basename(path)] = (mapName, round)
+	return entries
+
+def readSegment(path):
+	f = openSegment(path)
+	try:
+		if path.find(".dat") >= 0:
+			records = readRecords(f)
+		else:
+			records = readTextRecords(f)
+		return list(records)
+	finally:
+		f.close()
+
+def parseStartDate(text):
+	try:
+		return int(time.mktime(time.strptime(text, "%Y.%m.%d,%H:%M")))
+	except (ValueError, OverflowError):
+		return None
+
+
+
+def ingest(store, paths):
+	segmentIndexes = {}
+	numRounds = 0
+	rounds = findRounds(paths)
+	roundNames = rounds.keys()
+	roundNames.sort()
+	for roundName in roundNames:
+		segments = rounds[roundName]
+		sources = []
+		for segmentNr, path in segments:
+			sources.append((os.path.basename(path), os.path.getsize(path), int(os.path.getmtime(path))))
+		if store.isCurrent(roundName, sources): continue
+
+		round = Round()
+		mapName = ""
+		startedAt = None
+		for segmentNr, path in segments:
+			try:
+				records = readSegment(path)
+			except (IOError, ValueError), e:
+				print "Couldnt read %s: %s" % (path, e)
+				continue
+			for name, values in records:
+				if name == "INIT":
+					mapName = values[0] or mapName
+					startedAt = parseStartDate(values[2] or "")
+				round.add(name, values)
+
+		# rotated logs know when their round started
+		dir = os.path.dirname(segments[0][1]) or "."
+		if not segmentIndexes.has_key(dir):
+			segmentIndexes[dir] = readSegmentIndex(dir)
+		for segmentNr, path in segments:
+			entry = segmentIndexes[dir].get(os.path.basename(path))
+			if entry:
+				mapName, startedAt = entry
+				break
+		if startedAt == None:
+			startedAt = sources[0][2]
+
+		store.addRound(roundName, mapName, startedAt, sources, round)
+		numRounds += 1
+		print "%s: %d records from %d segments" % (roundName, len(round.records), len(segments))
+
+	store.save()
+	print "Ingested %d rounds, %d up to date" % (numRounds, len(rounds) - numRounds)
+
+
+
+def listRounds(store, numRounds, mapName):
+	for roundName in store.getRoundNames(numRounds, mapName):
+		roundMap, startedAt, sources, numRecords, summary = store.rounds[roundName]
+		print "%s\t%s\t%s\t%d records" % (roundName, roundMap, time.strftime("%Y.%m.%d %H:%M", time.localtime(startedAt)), numRecords)
+
+
+
+def query(store, terms, options):
+	cellTerms = [key for kind, key in terms if kind == "cell"]
+
+	counts = {}
+	encoder = TextEncoder(sys.stdout)
+	for roundName, name, values in store.query(terms, options.rounds, options.map):
+		# the cell index holds any position of a record, narrow it down
+		if options.pos:
+			cells = getKeys("cell", name, values, options.pos)
+			if not cells: continue
+			skip = False
+			for cell in cellTerms:
+				if not cell in cells:
+					skip = True
+					break
+			if skip: continue
+
+		if options.count:
+			for key in getKeys(options.count, name, values, options.pos):
+				counts[key] = counts.get(key, 0) + 1
+		else:
+			encoder.write(name, values)
+
+	if options.count:
+		results = [(-count, key) for key, count in counts.iteritems()]
+		results.sort()
+		for count, key in results:
+			if options.count == "cell":
+				key = cellStr(key)
+			print "%s\t%d" % (key, -count)
+
+
+
+def main(args):
+	parser = optparse.OptionParser(usage="%prog [options] ingest <log dir or file>... | rounds | query")
+	parser.add_option("-s", "--store", default=DEFAULT_STORE, help="store directory, " + DEFAULT_STORE + " if not given")
+	parser.add_option("-e", "--event", help="record name, like KILL or SCORE")
+	parser.add_option("-p", "--player", help="player name")
+	parser.add_option("-w", "--weapon", help="weapon template name")
+	parser.add_option("-c", "--cell", action="append", help="grid cell x,z, 0 to %d" % (GRID_SIZE - 1))
+	parser.add_option("-P", "--pos", help="position field the cell applies to, like VictimPos")
+	parser.add_option("-m", "--map", help="only rounds of this map")
+	parser.add_option("-r", "--rounds", type="int", default=0, help="only the last ROUNDS rounds")
+	parser.add_option("-n", "--count", type="choice", choices=indexKinds,
+			help="count matching records per event, player, weapon or cell")
+	options, args = parser.parse_args(args)
+	if not args:
+		parser.print_help()
+		return 1
+
+	if not os.path.isdir(options.store):
+		os.makedirs(options.store)
+	store = Store(options.store)
+
+	command = args[0]
+	if command == "ingest":
+		if len(args) < 2: parser.error("nothing to ingest")
+		ingest(store, args[1:])
+	elif command == "rounds":
+		listRounds(store, options.rounds, options.map)
+	elif command == "query":
+		terms = []
+		if options.event: terms.append(("event", options.event))
+		if options.player: terms.append(("player", options.player))
+		if options.weapon: terms.append(("weapon", options.weapon))
+		try:
+			for cell in options.cell or []:
+				terms.append(("cell", parseCell(cell)))
+		except ValueError:
+			parser.error("cells are given as x,z")
+		query(store, terms, options)
+	else:
+		parser.error("unknown command " + command)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -2,22 +2,41 @@
 # 
 # enable by typing this in the console:
 # pythonHost.sendCommand falog 1
+#
+# or, for the binary format of bf2.stats.falogformat:
+# pythonHost.sendCommand falog 1 binary
 
 # needs to be re-enabled in each round.
+#
+# records go through a buffered writer (see bf2.stats.logwriter), the log is
+# only guaranteed to be on disk once logging is disabled or the round ends.
+# long rounds are split into segments, which are compressed and listed in
+# Logs/faLog_index.txt once closed (see bf2.stats.logrotate).
 
 import host
 import bf2.PlayerManager
 import bf2.GameLogic
-import fpformat
 import datetime
 import time
-import fpformat
 from constants import *
 from bf2 import g_debug
+from bf2.stats.logwriter import POLICY_DROP
+from bf2.stats.logrotate import SegmentedLog, getSegmentIndex
+from bf2.stats.falogformat import TextEncoder, BinaryEncoder
+
+# drop records rather than stall the game when the disk cant keep up
+WRITER_POLICY = POLICY_DROP
+
+INDEX_NAME = "faLog_index.txt"
 
 logfile = None
 fileName = ""
 
+# world to fragalyzer space factors, the world size doesnt change during a
+# round so its only looked up when the map is loaded
+worldScaleX = 1.0
+worldScaleZ = 1.0
+
 
 def init():
 	host.registerHandler('ConsoleSendCommand', onSendCommand)
@@ -25,7 +44,7 @@ def init():
 	if g_debug: print "Fragalyzer log module initialized."
 
 	
-def enable():
+def enable(binary=False):
 	global fileName
 	global logfile
 	global startTime
@@ -35,32 +54,43 @@ def enable():
 		return 
 		
 	host.registerGameStatusHandler(onGameStatusChanged)
+	updateWorldScale()
 	
 	currentDate = datetime.datetime.today()
 	dateString = ""
 	dateString = time.strftime("%y%m%d_%H%M", currentDate.timetuple())
 
+	if binary:
+		extension = ".dat"
+		makeEncoder = BinaryEncoder
+	else:
+		extension = ".txt"
+		makeEncoder = TextEncoder
+
+	logDir = (bf2.gameLogic.getModDir() + "/Logs/").replace('/', '\\')
 	if dateString != "":
-		fileName = bf2.gameLogic.getModDir() + "/Logs/" + bf2.gameLogic.getMapName() + "_" + dateString + "_faLog.txt"
+		baseName = logDir + bf2.gameLogic.getMapName() + "_" + dateString + "_faLog"
 	else:
-		fileName = bf2.gameLogic.getModDir() + "/Logs/" + bf2.gameLogic.getMapName() + "_faLog.txt"
+		baseName = logDir + bf2.gameLogic.getMapName() + "_faLog"
 		
-	fileName = fileName.replace('/', '\\')
+	fileName = baseName + extension
 	
 	print "log file: ", fileName
 
+	# make room for this round first
+	index = getSegmentIndex(logDir + INDEX_NAME)
+	numExpired = index.expire()
+	if numExpired: print "Deleted %d expired fragalyzer log segments" % numExpired
+
 	try:
-		logfile = file (fileName, 'w')
+		logfile = SegmentedLog(baseName, extension, binary, makeEncoder, index, bf2.gameLogic.getMapName(), WRITER_POLICY)
 	except Exception:
 		if g_debug: print "Couldnt open fragalyzer logfile: ", fileName
 		return
 	
 	startTime = int(date())
-	timeString = str(startTime)
 	startDate = time.strftime("%Y.%m.%d,%H:%M", currentDate.timetuple())
-	logfile.write("INIT LevelName=" + bf2.gameLogic.getMapName() + " StartTime=" + timeString + " StartDate=" + startDate + " Filename=" + fileName + "\n")
-		
-	logfile.flush()
+	logfile.write("INIT", (bf2.gameLogic.getMapName(), startTime, startDate, fileName))
 
 
 	# register events
@@ -87,59 +117,42 @@ def enable():
 	print "Fragalyzer logging enabled."
 
 
+# counters that tell what a PlayerScore event was for, in order of precedence
+scoreTypes = ("cpCaptures", "cpDefends", "cpAssists", "cpNeutralizes", "cpNeutralizeAssists", "suicides", "kills", "TKs",
+		"damageAssists", "passengerAssists", "targetAssists", "revives", "teamDamages", "teamVehicleDamages")
+
 class faStat:
 	def __init__(self):
 		self.enterAt = 0
 		self.enterTemplate = None
 		self.spawnAt = 0
+		self.score = None
+		self.scoreToken = 0
 		
 	def copyStats(self, player):
-		self.damageAssists = player.score.damageAssists
-		self.passengerAssists = player.score.passengerAssists
-		self.targetAssists = player.score.targetAssists
-		self.revives = player.score.revives
-		self.teamDamages = player.score.teamDamages
-		self.teamVehicleDamages = player.score.teamVehicleDamages
-		self.cpCaptures = player.score.cpCaptures
-		self.cpDefends = player.score.cpDefends
-		self.cpAssists = player.score.cpAssists
-		self.cpNeutralizes = player.score.cpNeutralizes
-		self.cpNeutralizeAssists = player.score.cpNeutralizeAssists
-		self.suicides = player.score.suicides
-		self.kills = player.score.kills
-		self.TKs = player.score.TKs
+		# script-side counters are tracked by the score record itself, only the
+		# ingame kill counters need to be remembered
+		self.score = player.score
+		self.scoreToken = player.score.checkpoint()
+		self.kills, self.TKs = player.score.read(("kills", "TKs"))
 
 	def getChangedStats(self, player):
+		if player.score is self.score:
+			changed = player.score.changedSince(self.scoreToken)
+		else:
+			changed = 0
+		kills, TKs = player.score.read(("kills", "TKs"))
+
 		res = []
-		if player.score.cpCaptures > self.cpCaptures:
-			res += ["cpCaptures"]
-		if player.score.cpDefends > self.cpDefends:
-			res += ["cpDefends"]
-		if player.score.cpAssists > self.cpAssists:
-			res += ["cpAssists"]
-		if player.score.cpNeutralizes > self.cpNeutralizes:
-			res += ["cpNeutralizes"]
-		if player.score.cpNeutralizeAssists > self.cpNeutralizeAssists:
-			res += ["cpNeutralizeAssists"]
-		if player.score.suicides > self.suicides:
-			res += ["suicides"]
-		if player.score.kills > self.kills:
-			res += ["kills"]
-		if player.score.TKs > self.TKs:
-			res += ["TKs"]
-		if player.score.damageAssists > self.damageAssists:
-			res += ["damageAssists"]
-		if player.score.passengerAssists > self.passengerAssists:
-			res += ["passengerAssists"]
-		if player.score.targetAssists > self.targetAssists:
-			res += ["targetAssists"]
-		if player.score.revives > self.revives:
-			res += ["revives"]
-		if player.score.teamDamages > self.teamDamages:
-			res += ["teamDamages"]
-		if player.score.teamVehicleDamages > self.teamVehicleDamages:
-			res += ["teamVehicleDamages"]
-		
+		for scoreType in scoreTypes:
+			if scoreType == "kills":
+				if kills > self.kills:
+					res += [scoreType]
+			elif scoreType == "TKs":
+				if TKs > self.TKs:
+					res += [scoreType]
+			elif changed & bf2.PlayerManager.scoreBits[scoreType]:
+				res += [scoreType]
 			
 		return res
 		
@@ -159,9 +172,8 @@ def onPlayerConnect(player):
 
 	
 def disable():
-	if logfile:
-		timeString = str(int(date()))
-		logfile.write("DISABLE LevelName=" + bf2.gameLogic.getMapName() + " EndTime=" + timeString + "\n")
+	if logfile and not logfile.closed:
+		logfile.write("DISABLE", (bf2.gameLogic.getMapName(), int(date())))
 		logfile.close()
 		print "Fragalyzer logging disabled."
 	else:
@@ -171,26 +183,31 @@ def disable():
 
 def onGameStatusChanged(status):
 	if status == bf2.GameStatus.Playing:
-		pass
+		updateWorldScale()
 
 	elif status == bf2.GameStatus.EndGame:
 		disable()
 		
 	
-def getPosStr(orgPos):
+def updateWorldScale():
+	global worldScaleX
+	global worldScaleZ
+
 	worldSize = bf2.gameLogic.getWorldSize();
-	scale = [512.0 / worldSize[0], 1, 512.0 / worldSize[1]]
-#	scale = [1, 1, 1]
-	pos = [orgPos[0] * scale[0], orgPos[1] * scale[1], orgPos[2] * scale[2]]
-	res = str(fpformat.fix(pos[0], 3)) + "," + str(fpformat.fix(pos[1], 3)) + "," + str(fpformat.fix(pos[2], 3))
-	return res
+	worldScaleX = 512.0 / worldSize[0]
+	worldScaleZ = 512.0 / worldSize[1]
+
+
+# position scaled to the 512x512 map space of the fragalyzer
+def getPos(orgPos):
+	return (orgPos[0] * worldScaleX, orgPos[1], orgPos[2] * worldScaleZ)
 
 
 def onSendCommand(command, args):
 	if string.lower(command) == "falog":
 		if len(args) > 0:
 			if args[0] == "1":
-				enable()
+				enable(len(args) > 1 and string.lower(args[1]) == "binary")
 			elif args[0] == "0":
 				disable()
 		
@@ -198,8 +215,8 @@ def onSendCommand(command, args):
 def date():
 	return host.timer_getWallTime()
 
-def wallString():
-	return str(int(host.timer_getWallTime()) - startTime)
+def wallTime():
+	return int(host.timer_getWallTime()) - startTime
 
 #*********************************************************
 #  XPACK SPECIFIC
@@ -207,34 +224,28 @@ def wallString():
 def onDeployGrapplingHook(player):
 	vehicle = player.getVehicle()
 	name = player.getName()
-	team = str(player.getTeam())
+	team = player.getTeam()
 
 	if player:
-		logfile.write("GRAPPLE Name=" + name + " Team=" + team + " Pos=" + getPosStr(vehicle.getPosition()) + "\n")
-		
-	logfile.flush()
+		logfile.write("GRAPPLE", (name, team, getPos(vehicle.getPosition())))
 	return
 	
 def onDeployZipLine(player):
 	vehicle = player.getVehicle()
 	name = player.getName()
-	team = str(player.getTeam())
+	team = player.getTeam()
 
 	if player:
-		logfile.write("ZIPLINE Name=" + name + " Team=" + team + " Pos=" + getPosStr(vehicle.getPosition()) + "\n")
-		
-	logfile.flush()
+		logfile.write("ZIPLINE", (name, team, getPos(vehicle.getPosition())))
 	return
 	
 def onDeployTactical(player):
 	vehicle = player.getVehicle()
 	name = player.getName()
-	team = str(player.getTeam())
+	team = player.getTeam()
 
 	if player:
-		logfile.write("TACTICAL Name=" + name + " Team=" + team + " Pos=" + getPosStr(vehicle.getPosition()) + "\n")
-		
-	logfile.flush()
+		logfile.write("TACTICAL", (name, team, getPos(vehicle.getPosition())))
 	return
 	
 #*********************************************************
@@ -251,15 +262,11 @@ def onEnterVehicle(player, vehicle, freeSoldier = False):
 	if vehicleType == VEHICLE_TYPE_SOLDIER:
 		pass
 	else:
-		timeString = wallString()
-		playerTeam = str(player.getTeam())
-		logfile.write("ENTER PlayerName=" + player.getName() + " PlayerTeam=" + playerTeam + " VehicleName=" + rootVehicle.templateName + " Time=" + timeString + "\n")
+		logfile.write("ENTER", (player.getName(), player.getTeam(), rootVehicle.templateName, wallTime()))
 		player.fa.enterAt = date()
 		player.fa.enterTemplate = rootVehicle.templateName
 		
 
-	logfile.flush()
-
 	return
 
 def onPlayerSpawn(player, soldier):
@@ -269,7 +276,6 @@ def onExitVehicle(player, vehicle):
 	if player == None: return
 	rootVehicle = bf2.objectManager.getRootParent(vehicle)
 	vehicleType = getVehicleType(rootVehicle.templateName)
-	playerTeam = str(player.getTeam())
 
 	if vehicleType == VEHICLE_TYPE_SOLDIER:
 		pass
@@ -277,32 +283,22 @@ def onExitVehicle(player, vehicle):
 		timeInVehicle = 0
 		if player.fa.enterTemplate == rootVehicle.templateName:
 			timeInVehicle = date() - player.fa.enterAt
-		timeString = wallString()
-		logfile.write("EXIT PlayerName=" + player.getName() + " PlayerTeam=" + playerTeam + " VehicleName=" + rootVehicle.templateName + " VehicleTime="\
-		 + str(fpformat.fix(timeInVehicle, 1)) + " Time=" + timeString + "\n")
+		logfile.write("EXIT", (player.getName(), player.getTeam(), rootVehicle.templateName, timeInVehicle, wallTime()))
 		
 	player.fa.enterAt = 0
-	
-	logfile.flush()
 	return
 
 def onPickupKit(player, kit):
-	timeString = wallString()
-	playerSpawnTimePickupDiff = str(int(date())-int(player.stats.spawnedAt))
-	playerTeam = str(player.getTeam())
-	logfile.write("PICKUPKIT PlayerName=" + player.getName() + " PlayerTeam=" + playerTeam + " PlayerKit=" + kit.templateName + " PickupSpawnDiff=" + playerSpawnTimePickupDiff + " Time=" + timeString + "\n")
+	playerSpawnTimePickupDiff = int(date())-int(player.stats.spawnedAt)
+	logfile.write("PICKUPKIT", (player.getName(), player.getTeam(), kit.templateName, playerSpawnTimePickupDiff, wallTime()))
 	player.fa.spawnAt = date()
 	player.lastKitTemplateName = kit.templateName
-	logfile.flush()
 	
 def onDropKit(player, kit):
 	timeInVehicle = 0
 	if player.fa.spawnAt != 0:
 		timeInVehicle = date() - player.fa.spawnAt 
-	timeString = wallString()
-	playerTeam = str(player.getTeam())
-	logfile.write("DROPKIT PlayerName=" + player.getName() + " PlayerTeam=" + playerTeam + " PlayerKit=" + kit.templateName + " PlayerKitTime=" + str(fpformat.fix(timeInVehicle, 1)) + " Time=" + timeString + "\n")
-	logfile.flush()
+	logfile.write("DROPKIT", (player.getName(), player.getTeam(), kit.templateName, timeInVehicle, wallTime()))
 	return
 
 def onPlayerKilled(victim, attacker, weapon, assists, object):
@@ -311,7 +307,7 @@ def onPlayerKilled(victim, attacker, weapon, assists, object):
 	victimRootVehicle = bf2.objectManager.getRootParent(victimVehicle)
 	victimVehicleType = getVehicleType(victimRootVehicle.templateName)
 	victimName = victim.getName()
-	victimTeam = str(victim.getTeam())
+	victimTeam = victim.getTeam()
 
 	if attacker:
 		attackerKitName = attacker.lastKitTemplateName	
@@ -319,34 +315,33 @@ def onPlayerKilled(victim, attacker, weapon, assists, object):
 		attackerRootVehicle = bf2.objectManager.getRootParent(attackerVehicle)
 		attackerVehicleType = getVehicleType(attackerRootVehicle.templateName)
 		attackerName = attacker.getName()
-		attackerTeam = str(attacker.getTeam())
+		attackerTeam = attacker.getTeam()
+		attackerPos = getPos(attackerVehicle.getPosition())
 	else:
 		attackerKitName = None
 		attackerVehicle = None
 		attackerRootVehicle = None
 		attackerVehicleType = VEHICLE_TYPE_UNKNOWN
-		
-	logfile.write("KILL")
-	if attacker:
-		logfile.write(" AttackerName=" + attackerName + " AttackerTeam=" + attackerTeam + " AttackerPos=" + getPosStr(attackerVehicle.getPosition()))
+		attackerName = attackerTeam = attackerPos = None
+
+	victimPos = victimVehicleName = None
 	if victimVehicle != None:
-		logfile.write(" VictimName=" + victimName + " VictimTeam=" + victimTeam + " VictimPos=" + getPosStr(victimVehicle.getPosition()))
-		if victimKitName != None:
-			logfile.write(" VictimKit=" + victimKitName)
-		if victimVehicle != None and (attackerVehicleType != VEHICLE_TYPE_SOLDIER):
-			logfile.write(" VictimVehicle=" + victimRootVehicle.templateName)
-
-	if attackerKitName != None:
-		logfile.write(" AttackerKit=" + attackerKitName)
+		victimPos = getPos(victimVehicle.getPosition())
+		if attackerVehicleType != VEHICLE_TYPE_SOLDIER:
+			victimVehicleName = victimRootVehicle.templateName
+	else:
+		victimName = victimTeam = victimKitName = None
+
+	attackerVehicleName = None
 	if attackerVehicle != None and (attackerVehicleType != VEHICLE_TYPE_SOLDIER):
-		logfile.write(" AttackerVehicle=" + attackerRootVehicle.templateName)
+		attackerVehicleName = attackerRootVehicle.templateName
 		
+	weaponName = None
 	if weapon != None:
-		logfile.write(" AttackerWeapon=" + weapon.templateName)
+		weaponName = weapon.templateName
 
-	timeString = wallString()	
-	logfile.write(" Time=" + timeString + "\n")
-	logfile.flush()
+	logfile.write("KILL", (attackerName, attackerTeam, attackerPos, victimName, victimTeam, victimPos, victimKitName, victimVehicleName,
+		attackerKitName, attackerVehicleName, weaponName, wallTime()))
 
 def onPlayerDeath(victim, vehicle):
 
@@ -366,10 +361,7 @@ def onPlayerDeath(victim, vehicle):
 		hits = 0
 		if templateName in tempFireMap:
 			hits = tempFireMap[templateName]
-		timeString = wallString()
-		logfile.write("FIRED PlayerName=" + victim.getName() + " Weapon=" + templateName + " ShotsFired=" + str(fired) + " ShotsHit=" + str(hits) + " Time=" + timeString + "\n")
-
-	logfile.flush()
+		logfile.write("FIRED", (victim.getName(), templateName, fired, hits, wallTime()))
 
 
 def onCPStatusChange(cp, attackingTeam):
@@ -381,11 +373,7 @@ def onCPStatusChange(cp, attackingTeam):
 			return
 		captureType = "neutral"
 	
-	timeString = wallString()
-	logfile.write("CAPTURE ControlPointID=" + cp.getTemplateProperty('controlPointId') + " CaptureType=" + captureType\
-	 + " CaptureTeam=" + str(attackingTeam) + " CapturePointPos=" + getPosStr(cp.getPosition()) + " Time=" + timeString + "\n")
-	 
-	logfile.flush()
+	logfile.write("CAPTURE", (cp.getTemplateProperty('controlPointId'), captureType, attackingTeam, getPos(cp.getPosition()), wallTime()))
 	
 	 
 def onPlayerScore(player, difference):
@@ -395,7 +383,6 @@ def onPlayerScore(player, difference):
 		playerRootVeh = bf2.objectManager.getRootParent(playerVeh)
 		playerVehName = playerRootVeh.templateName
 		playerVehType = getVehicleType(playerRootVeh.templateName)
-		timeString = wallString()
 		
 		# figure out score type
 		scoreTypeList = player.fa.getChangedStats(player)
@@ -405,9 +392,7 @@ def onPlayerScore(player, difference):
 		else:
 			scoreType = "Unknown"
 			
-		logfile.write("SCORE ScoreDiff=" + str(difference) + " PlayerName=" + player.getName() + " PlayerTeam=" + str(player.getTeam()) + " PlayerKit=" + playerKitName)
-		if (playerVeh != None) and (playerVehType != VEHICLE_TYPE_SOLDIER):
-			logfile.write(" PlayerVehicle=" + playerVehName)
-		logfile.write(" PlayerPos=" + getPosStr(playerVeh.getPosition()) + " Time=" + timeString + " Scoretype=" + scoreType + "\n")
-
-	logfile.flush()
+		if (playerVeh == None) or (playerVehType == VEHICLE_TYPE_SOLDIER):
+			playerVehName = None
+		logfile.write("SCORE", (difference, player.getName(), player.getTeam(), playerKitName, playerVehName,
+			getPos(playerVeh.getPosition()), wallTime(), scoreType))
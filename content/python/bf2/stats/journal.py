@@ -0,0 +1,446 @@
+# session stats journal for ranked servers.
+#
+# the session stats map only lives in memory. to survive a crash or restart
+# the state of every PlayerStat is written to <modDir>/Logs:
+#
+#   stats_checkpoint.dat	full state of all records, written at round start
+#				and whenever the journal grows past CHECKPOINT_SIZE
+#   stats_journal.dat		fields changed since the checkpoint, appended in
+#				batches every FLUSH_INTERVAL seconds
+#
+# both are marshal streams. on startup the checkpoint is loaded, the journal
+# is replayed on top of it and the session stats map is rebuilt from the
+# result. a batch cut short by a crash is dropped.
+#
+# a batch only rebuilds the records of players that an event touched since
+# the last one. the times of players that are just playing on grow without
+# events, so all records are compared every REFRESH_INTERVAL seconds.
+
+import host
+import os
+import time
+import array
+import marshal
+import bf2
+import bf2.PlayerManager
+import bf2.stats.stats as stats
+from bf2.stats.constants import *
+from bf2 import g_debug
+
+JOURNAL_VERSION = 2
+CHECKPOINT_NAME = "stats_checkpoint.dat"
+JOURNAL_NAME = "stats_journal.dat"
+
+# seconds between journal batches
+FLUSH_INTERVAL = 5.0
+
+# seconds between forcing the journal to disk, 0 syncs every batch
+FSYNC_INTERVAL = 30.0
+
+# journal size in bytes after which a new checkpoint is written
+CHECKPOINT_SIZE = 256 * 1024
+
+# seconds between batches that compare all records, not just the touched ones
+REFRESH_INTERVAL = 30.0
+
+# journal records
+RECORD_CHANGES = 0
+RECORD_END_ROUND = 1
+
+# PlayerStat attributes kept in the journal, in record field order. times are
+# stored with their open part added and come back as closed totals.
+playerFields = ('profileId', 'playerId', 'connectionOrderNr', 'name', 'ipaddr', 'rank', 'team', 'timeOnLine',
+		'currentKillStreak', 'longestKillStreak', 'currentDeathStreak', 'longestDeathStreak',
+		'wasHereAtStart', 'wasHereAtEnd', 'complete', 'timesBanned', 'timesKicked',
+		'killedPlayer') + stats.playerStatCounters
+# PlayerStat attributes for stats.copiedScores, as set by copyPlayerData
+liveScoreFields = ('score', 'cmdScore', 'teamScore', 'skillScore', 'kills', 'teamkills', 'deaths', 'rank')
+clampedScoreFields = ('score', 'cmdScore', 'teamScore', 'skillScore')
+timeFields = ('timePlayed', 'timeAsCmd', 'timeAsSql', 'timeInSquad')
+tableKinds = ('vehicles', 'weapons', 'kits')
+tableCounters = [name for name in stats.objectStatCounters if not name in ('bulletsFiredTemp', 'bulletsHitTemp', 'enterScore')]
+
+# events that change the records of players, as event -> argument nrs of the
+# players concerned
+dirtyEvents = (
+	('PlayerConnect',	(0,)),
+	('PlayerDisconnect',	(0,)),
+	('PlayerSpawn',		(0,)),
+	('PlayerDeath',		(0,)),
+	('PlayerKilled',	(0, 1)),
+	('PlayerScore',		(0,)),
+	('PlayerChangeTeams',	(0,)),
+	('PlayerChangeWeapon',	(0,)),
+	('EnterVehicle',	(0,)),
+	('ExitVehicle',		(0,)),
+	('PickupKit',		(0,)),
+	('DropKit',		(0,)),
+	('PlayerChangedSquad',	(0,)),
+	('ChangedCommander',	(1, 2)),
+	('ChangedSquadLeader',	(1, 2)),
+	('PlayerBanned',	(0,)),
+	('PlayerKicked',	(0,)),
+	('DeployGrapplingHook',	(0,)),
+	('DeployZipLine',	(0,)),
+	('DeployTactical',	(0,)),
+	('PlayerStatsResponse',	(1,)),
+)
+
+journal = None
+journalSize = 0
+lastSync = 0
+lastRefresh = 0
+flushCall = None
+
+# connectionOrderNrs of the records touched since the last batch
+dirtyRecords = {}
+
+# records of departed players whose round start reset is still pending, they
+# change without an event once it has run
+pendingResets = []
+
+# state of every record as last written, connectionOrderNr -> field list
+writtenStates = {}
+
+# (round info, stats map) of a round that was cut short, if any. the records
+# are the ones installed in the session stats map on recovery.
+recoveredRound = None
+
+
+
+def init():
+	if not host.ss_getParam('ranked'):
+		if g_debug: print "Stats journal disabled, server not ranked."
+		return
+
+	recover()
+	host.registerGameStatusHandler(onGameStatusChanged)
+	for event, playerArgs in dirtyEvents:
+		host.registerHandler(event, makeDirtyHandler(playerArgs), 1)
+	host.registerHandler('Reset', onReset, 1)
+
+	if g_debug: print "Stats journal module initialized."
+
+
+
+def getRecoveredRound():
+	return recoveredRound
+
+
+
+def getLogDir():
+	return bf2.gameLogic.getModDir() + "/Logs"
+
+
+
+def onGameStatusChanged(status):
+	global flushCall
+
+	if status == bf2.GameStatus.Playing:
+		checkpoint()
+		if not flushCall:
+			flushCall = bf2.scheduler.schedule(onFlush, FLUSH_INTERVAL, None, FLUSH_INTERVAL)
+
+	elif status == bf2.GameStatus.EndGame:
+		if flushCall:
+			flushCall.cancel()
+			flushCall = None
+
+		# players have been finalized by the stats module at this point
+		flush(RECORD_END_ROUND)
+
+
+
+# handler that marks the records of the players in playerArgs as touched
+def makeDirtyHandler(playerArgs):
+	def onEvent(*args):
+		for i in playerArgs:
+			playerStat = getattr(args[i], 'stats', None)
+			if playerStat != None and playerStat.connectionOrderNr != None:
+				dirtyRecords[playerStat.connectionOrderNr] = 1
+	return onEvent
+
+
+
+# all records were reset, compare them all in the next batch
+def onReset(data):
+	global lastRefresh
+	lastRefresh = 0
+
+
+
+def onFlush(data):
+	flush()
+	if journalSize > CHECKPOINT_SIZE:
+		checkpoint()
+
+
+
+# appends the fields changed since the last write of the touched records, or
+# of every record when a refresh is due or the batch is marked
+def flush(marker=None):
+	global journalSize
+	global lastSync
+	global lastRefresh
+
+	if not journal: return
+
+	now = stats.date()
+	statsMap = stats.getStatsMap()
+
+	for playerStat in pendingResets[:]:
+		if not playerStat.resetPending:
+			pendingResets.remove(playerStat)
+			dirtyRecords[playerStat.connectionOrderNr] = 1
+
+	if marker != None or now - lastRefresh >= REFRESH_INTERVAL:
+		records = statsMap.items()
+		lastRefresh = now
+	else:
+		records = [(nr, statsMap[nr]) for nr in dirtyRecords.iterkeys() if statsMap.has_key(nr)]
+	dirtyRecords.clear()
+	if not records and marker == None: return
+
+	players = getConnectedPlayers()
+	changes = []
+	for nr, playerStat in records:
+		state = getState(playerStat, now, players.get(id(playerStat)))
+		written = writtenStates.get(nr)
+		if written == None:
+			changes.append((nr, list(enumerate(state))))
+		else:
+			fields = [(i, value) for i, value in enumerate(state) if value != written[i]]
+			if not fields: continue
+			changes.append((nr, fields))
+		writtenStates[nr] = state
+
+	if not changes and marker == None: return
+
+	try:
+		data = marshal.dumps((RECORD_CHANGES, changes))
+		if marker != None:
+			data += marshal.dumps((marker, time.time()))
+		journal.write(data)
+		journal.flush()
+		journalSize += len(data)
+
+		if marker != None or now - lastSync >= FSYNC_INTERVAL:
+			sync(journal)
+			lastSync = now
+	except IOError:
+		print "Couldnt write stats journal"
+
+
+
+# writes the full state of all records and starts an empty journal
+def checkpoint():
+	global journal
+	global journalSize
+	global lastSync
+	global lastRefresh
+
+	if journal: journal.close()
+	journal = None
+
+	logDir = getLogDir()
+	now = stats.date()
+	players = getConnectedPlayers()
+	writtenStates.clear()
+	dirtyRecords.clear()
+	pendingResets[:] = []
+	for nr, playerStat in stats.getStatsMap().iteritems():
+		writtenStates[nr] = getState(playerStat, now, players.get(id(playerStat)))
+		if playerStat.resetPending: pendingResets.append(playerStat)
+
+	roundInfo = (bf2.gameLogic.getMapName(), time.time())
+	try:
+		f = open(logDir + "/" + CHECKPOINT_NAME + ".tmp", "wb")
+		marshal.dump((JOURNAL_VERSION, roundInfo, writtenStates), f)
+		sync(f)
+		f.close()
+
+		# rename wont replace an existing file on all platforms
+		try:
+			os.remove(logDir + "/" + CHECKPOINT_NAME)
+		except OSError:
+			pass
+		os.rename(logDir + "/" + CHECKPOINT_NAME + ".tmp", logDir + "/" + CHECKPOINT_NAME)
+
+		journal = open(logDir + "/" + JOURNAL_NAME, "wb")
+	except (IOError, OSError):
+		print "Couldnt write stats checkpoint in ", logDir
+		return
+
+	journalSize = 0
+	lastSync = now
+	lastRefresh = now
+
+
+
+def sync(f):
+	f.flush()
+	if hasattr(os, 'fsync'):
+		os.fsync(f.fileno())
+
+
+
+# loads the checkpoint and replays the journal on top of it
+def recover():
+	global recoveredRound
+
+	logDir = getLogDir()
+	try:
+		f = open(logDir + "/" + CHECKPOINT_NAME, "rb")
+	except IOError:
+		return
+
+	try:
+		try:
+			version, roundInfo, states = marshal.load(f)
+		except (EOFError, ValueError, TypeError):
+			print "Ignored unreadable stats checkpoint"
+			return
+	finally:
+		f.close()
+
+	if version != JOURNAL_VERSION: return
+
+	finished = False
+	numRecords = 0
+	try:
+		f = open(logDir + "/" + JOURNAL_NAME, "rb")
+	except IOError:
+		f = None
+
+	if f:
+		try:
+			while 1:
+				try:
+					record = marshal.load(f)
+				except (EOFError, ValueError, TypeError):
+					break
+
+				if record[0] == RECORD_CHANGES:
+					for nr, fields in record[1]:
+						state = states.setdefault(nr, [None] * numStateFields)
+						for i, value in fields:
+							state[i] = value
+				elif record[0] == RECORD_END_ROUND:
+					finished = True
+				numRecords += 1
+		finally:
+			f.close()
+
+	statsMap = {}
+	for nr, state in states.iteritems():
+		if state[0] == None: continue
+		statsMap[nr] = restore(state)
+	stats.setStatsMap(statsMap)
+
+	# players connecting before the round starts playing get nrs after the
+	# recovered ones
+	if statsMap:
+		stats.setPlayerConnectionOrderIterator(max(statsMap.keys()) + 1)
+
+	if not finished:
+		recoveredRound = (roundInfo, statsMap.copy())
+
+	print "Recovered %d session stats records from %d journal records" % (len(statsMap), numRecords)
+
+
+
+# id(PlayerStat) -> player, for the records of connected players
+def getConnectedPlayers():
+	players = {}
+	for p in bf2.playerManager.getPlayers():
+		if getattr(p, 'stats', None) != None:
+			players[id(p.stats)] = p
+	return players
+
+
+
+# the state of a record. the scores of connected players are only copied to
+# their record when they are finalized, so they are read from the player.
+def getState(playerStat, now, player=None):
+	state = [getattr(playerStat, name) for name in playerFields]
+
+	if player != None:
+		for name, value in zip(liveScoreFields, player.score.read(stats.copiedScores)):
+			if name in clampedScoreFields and value < 0: value = 0
+			state[playerFields.index(name)] = value
+		state[playerFields.index('timeOnLine')] += now - playerStat.connectAt
+		state[playerFields.index('team')] = player.getTeam()
+
+	# dicts are copied, as the written state is compared to the live one
+	for i in range(len(state)):
+		if type(state[i]) == dict:
+			state[i] = state[i].copy()
+	for name in timeFields:
+		state.append(playerStat.getTime(name, now))
+	state.extend([playerStat.getTimeAsArmy(a, now) for a in range(0, NUM_ARMIES + 1)])
+	state.extend([getattr(playerStat.localScore, name) for name in bf2.PlayerManager.scriptScores])
+
+	# table entries are fields of their own, so a change only writes the entry
+	for kind in tableKinds:
+		table = getattr(playerStat, kind)
+		base = table.base
+		for name in tableCounters:
+			state.extend(table.columns[name][base:base + table.numTypes].tolist())
+		state.extend([s.getTimeInObject(now) for s in table.itervalues()])
+
+	return state
+
+numStateFields = (len(playerFields) + len(timeFields) + NUM_ARMIES + 1 + len(bf2.PlayerManager.scriptScores) +
+		(len(tableCounters) + 1) * (NUM_VEHICLE_TYPES + NUM_WEAPON_TYPES + NUM_KIT_TYPES + 3))
+
+
+
+class RecoveredPlayer:
+	"""Stands in for the player of a record rebuilt from the journal, which
+	isnt connected when the record is created."""
+	def __init__(self, index, profileId, name, address):
+		self.index = index
+		self.profileId = profileId
+		self.name = name
+		self.address = address
+		self.score = bf2.PlayerManager.PlayerScore(index)
+
+	def getProfileId(self): return self.profileId
+	def getName(self): return self.name
+	def getAddress(self): return self.address
+
+
+
+# creates a PlayerStat from a journal state
+def restore(state):
+	fields = dict(zip(playerFields, state))
+	player = RecoveredPlayer(fields['playerId'], fields['profileId'], fields['name'], fields['ipaddr'])
+	playerStat = stats.PlayerStat(player)
+
+	# in field order, the kill matrix row needs the connectionOrderNr
+	for name in playerFields:
+		setattr(playerStat, name, fields[name])
+
+	i = len(playerFields)
+	for name in timeFields:
+		setattr(playerStat, stats.playerTimes[name][0], state[i])
+		i += 1
+	for a in range(0, NUM_ARMIES + 1):
+		playerStat.timeAsArmy[a] = state[i]
+		i += 1
+	for name in bf2.PlayerManager.scriptScores:
+		setattr(playerStat.localScore, name, state[i])
+		i += 1
+	for name in stats.sessionScores:
+		playerStat.columns[name][playerStat.row] = getattr(playerStat.localScore, name)
+
+	for kind in tableKinds:
+		table = getattr(playerStat, kind)
+		base = table.base
+		numTypes = table.numTypes
+		for name in tableCounters + ['rawTimeInObject']:
+			column = table.columns[name]
+			column[base:base + numTypes] = array.array(column.typecode, state[i:i + numTypes])
+			i += numTypes
+
+	return playerStat
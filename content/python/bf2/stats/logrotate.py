@@ -0,0 +1,292 @@
+# rotating, compressed log segments.
+#
+# a SegmentedLog writes its records to a series of segment files, starting a
+# new one when the current one grows past MAX_SEGMENT_BYTES or gets older than
+# MAX_SEGMENT_AGE seconds. closed segments are added to an index file next to
+# them, one line per segment:
+#
+#   <map>	<round>	<segment nr>	<file name>	<size>	<closed at>
+#
+# segments are indexed from the game thread when they are closed, and indexed
+# again once the writer thread has gzipped them. a later line for a segment
+# replaces the earlier one, so a segment whose compression was cut short by a
+# shutdown is still indexed and expired.
+#
+# rounds are identified by the time their log was opened. file names are
+# relative to the index. retention works off the index alone: the oldest
+# segments are deleted once all segments take more than MAX_LOG_BYTES, or when
+# they were closed more than MAX_LOG_AGE seconds ago.
+
+import os
+import time
+
+# reading segments and the index works without the game, see faquery.py
+try:
+	from bf2.stats.logwriter import LogWriter
+except ImportError:
+	LogWriter = None
+
+try:
+	import threading
+except ImportError:
+	threading = None
+
+try:
+	import gzip
+except ImportError:
+	gzip = None
+
+MAX_SEGMENT_BYTES = 8 * 1024 * 1024
+MAX_SEGMENT_AGE = 3600
+
+# gzip closed segments, if zlib is available
+COMPRESS_SEGMENTS = 1
+COMPRESS_LEVEL = 6
+COPY_CHUNK = 64 * 1024
+
+# retention, 0 keeps segments forever
+MAX_LOG_BYTES = 512 * 1024 * 1024
+MAX_LOG_AGE = 14 * 24 * 3600
+
+
+
+# path with its file name cut off, for paths with either kind of separator
+def splitPath(path):
+	i = max(path.rfind('/'), path.rfind('\\'))
+	return path[:i + 1], path[i + 1:]
+
+
+
+# gzips a file and removes the original. returns the path of the result.
+def compressFile(path):
+	if not gzip or not COMPRESS_SEGMENTS: return path
+
+	try:
+		src = open(path, "rb")
+		dst = open(path + ".gz.tmp", "wb")
+		try:
+			zipped = gzip.GzipFile(splitPath(path)[1], "wb", COMPRESS_LEVEL, dst)
+			while 1:
+				data = src.read(COPY_CHUNK)
+				if not data: break
+				zipped.write(data)
+			zipped.close()
+		finally:
+			src.close()
+			dst.close()
+
+		# rename wont replace an existing file on all platforms
+		if os.path.exists(path + ".gz"):
+			os.remove(path + ".gz")
+		os.rename(path + ".gz.tmp", path + ".gz")
+		os.remove(path)
+	except (IOError, OSError):
+		return path
+
+	return path + ".gz"
+
+
+
+# deletes a segment. a segment indexed before it was compressed may have been
+# compressed since, or partly.
+def removeSegment(path):
+	paths = [path]
+	if path[-3:] != ".gz":
+		paths.extend([path + ".gz", path + ".gz.tmp"])
+	for path in paths:
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+
+
+# opens a segment for reading, compressed or not
+def openSegment(path):
+	if path[-3:] == ".gz":
+		if not gzip: raise IOError, "cant read compressed segment without zlib: " + path
+		return gzip.open(path, "rb")
+	return open(path, "rb")
+
+
+
+# indexes by path. the logs of all rounds share one, so that segments added
+# by the writer thread of a previous round and expired by the next round are
+# serialized by the same lock.
+segmentIndexes = {}
+
+def getSegmentIndex(path):
+	index = segmentIndexes.get(path)
+	if index == None:
+		index = SegmentIndex(path)
+		segmentIndexes[path] = index
+	return index
+
+
+
+class SegmentIndex:
+	"""The index file of the segments in a directory. Segments are added from
+	writer threads, so the file is only touched under a lock."""
+	def __init__(self, path):
+		self.path = path
+		self.dir = splitPath(path)[0]
+		if threading:
+			self.lock = threading.Lock()
+		else:
+			self.lock = None
+
+	# adds or replaces the entry of a segment. the size is taken from the file
+	# unless given.
+	def add(self, mapName, round, segmentNr, path, size=None):
+		fileName = splitPath(path)[1]
+		if size == None:
+			try:
+				size = os.path.getsize(path)
+			except OSError:
+				size = 0
+		line = "%s\t%d\t%d\t%s\t%d\t%d\n" % (mapName, round, segmentNr, fileName, size, int(time.time()))
+
+		if self.lock: self.lock.acquire()
+		try:
+			try:
+				f = open(self.path, "a")
+				f.write(line)
+				f.close()
+			except IOError:
+				pass
+		finally:
+			if self.lock: self.lock.release()
+
+	# the index entries as (map, round, segment nr, path, size, closed at)
+	def read(self):
+		if self.lock: self.lock.acquire()
+		try:
+			return self._read()
+		finally:
+			if self.lock: self.lock.release()
+
+	def _read(self):
+		entries = []
+		try:
+			f = open(self.path, "r")
+		except IOError:
+			return entries
+
+		# (map, round, segment nr) -> position in entries
+		positions = {}
+		try:
+			for line in f:
+				fields = line.rstrip("\r\n").split("\t")
+				if len(fields) != 6: continue
+				mapName, round, segmentNr, fileName, size, closedAt = fields
+				entry = (mapName, int(round), int(segmentNr), self.dir + fileName, int(size), int(closedAt))
+				key = entry[:3]
+				if positions.has_key(key):
+					entries[positions[key]] = entry
+				else:
+					positions[key] = len(entries)
+					entries.append(entry)
+		finally:
+			f.close()
+		return entries
+
+	# deletes the segments past the retention limits and drops them from the
+	# index
+	def expire(self, maxBytes=MAX_LOG_BYTES, maxAge=MAX_LOG_AGE):
+		if self.lock: self.lock.acquire()
+		try:
+			entries = self._read()
+			now = time.time()
+			kept = []
+			total = 0
+
+			# newest segments are at the end
+			entries.reverse()
+			for entry in entries:
+				total += entry[4]
+				if (maxBytes and total > maxBytes) or (maxAge and now - entry[5] > maxAge):
+					removeSegment(entry[3])
+				else:
+					kept.append(entry)
+
+			if len(kept) == len(entries): return 0
+			kept.reverse()
+
+			try:
+				f = open(self.path + ".tmp", "w")
+				for mapName, round, segmentNr, path, size, closedAt in kept:
+					f.write("%s\t%d\t%d\t%s\t%d\t%d\n" % (mapName, round, segmentNr, splitPath(path)[1], size, closedAt))
+				f.close()
+				os.remove(self.path)
+				os.rename(self.path + ".tmp", self.path)
+			except (IOError, OSError):
+				pass
+
+			return len(entries) - len(kept)
+		finally:
+			if self.lock: self.lock.release()
+
+
+
+class SegmentedLog:
+	"""Log of a round, written as a series of segments named baseName +
+	extension, then baseName_1 + extension and so on. Records are written
+	through an encoder made with makeEncoder(writer) for every segment, so
+	each segment can be read on its own."""
+	def __init__(self, baseName, extension, binary, makeEncoder, index, mapName, policy):
+		self.baseName = baseName
+		self.extension = extension
+		self.binary = binary
+		self.makeEncoder = makeEncoder
+		self.index = index
+		self.mapName = mapName
+		self.policy = policy
+		self.round = int(time.time())
+		self.segmentNr = 0
+		self.closed = False
+		self.open()
+
+	def getSegmentName(self, segmentNr):
+		if segmentNr == 0:
+			return self.baseName + self.extension
+		return "%s_%d%s" % (self.baseName, segmentNr, self.extension)
+
+	def open(self):
+		self.fileName = self.getSegmentName(self.segmentNr)
+		if self.binary:
+			mode = 'wb'
+		else:
+			mode = 'w'
+		self.writer = LogWriter(file (self.fileName, mode), self.policy)
+		self.encoder = self.makeEncoder(self.writer)
+		self.openedAt = time.time()
+
+	def write(self, name, values):
+		if self.closed: return
+		self.encoder.write(name, values)
+		if self.writer.numBytes >= MAX_SEGMENT_BYTES or time.time() - self.openedAt >= MAX_SEGMENT_AGE:
+			self.rotate()
+
+	def rotate(self):
+		self.closeSegment(False)
+		self.segmentNr += 1
+		try:
+			self.open()
+		except IOError:
+			print "Couldnt open log segment: ", self.fileName
+			self.closed = True
+
+	# the game thread only waits for the last segment to be written, not for
+	# it to be compressed
+	def close(self):
+		if self.closed: return
+		self.closed = True
+		self.closeSegment(True)
+
+	def closeSegment(self, wait):
+		self.index.add(self.mapName, self.round, self.segmentNr, self.fileName, self.writer.numBytes)
+		self.writer.close(wait, self.onSegmentClosed, (self.segmentNr, self.fileName))
+
+	def onSegmentClosed(self, data):
+		segmentNr, fileName = data
+		self.index.add(self.mapName, self.round, segmentNr, compressFile(fileName))
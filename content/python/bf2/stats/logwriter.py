@@ -0,0 +1,217 @@
+# buffered log writer.
+#
+# records are collected in memory on the game thread and handed to a writer
+# thread in batches, once a batch grows past FLUSH_SIZE bytes or every
+# FLUSH_INTERVAL seconds. the writer thread takes batches from a bounded
+# queue. when the queue is full a batch is either dropped or the game thread
+# waits for room, depending on the writer's policy.
+#
+# without thread support, or once the writer thread is gone, the batches are
+# written on the game thread.
+
+import bf2
+
+try:
+	import threading
+	import Queue
+except ImportError:
+	threading = None
+
+# batch size in bytes that is handed to the writer right away
+FLUSH_SIZE = 16 * 1024
+
+# seconds a record may wait in the batch before it is handed to the writer
+FLUSH_INTERVAL = 2.0
+
+# batches waiting for the writer thread before the full queue policy applies
+MAX_PENDING_BATCHES = 64
+
+# what to do with a batch when the queue is full
+POLICY_BLOCK = 0
+POLICY_DROP = 1
+
+
+
+class LogWriter:
+	"""File-like sink that writes to out in batches, from a background thread
+	if available. Writes after close() are ignored."""
+	def __init__(self, out, policy=POLICY_BLOCK):
+		self.out = out
+		self.policy = policy
+		self.closed = False
+		self.batch = []
+		self.batchSize = 0
+		self.numBytes = 0
+		self.numDropped = 0
+		self.numErrors = 0
+
+		self.flushCall = bf2.scheduler.schedule(self.onFlushTimer, FLUSH_INTERVAL, None, FLUSH_INTERVAL)
+
+		if threading:
+			self.queue = Queue.Queue(MAX_PENDING_BATCHES)
+			self.running = 1
+			self.thread = threading.Thread(target=self.run)
+			self.thread.setDaemon(1)
+			self.thread.start()
+		else:
+			self.queue = None
+			self.running = 0
+			self.thread = None
+
+	def write(self, data):
+		if self.closed: return
+		self.batch.append(data)
+		self.batchSize += len(data)
+		self.numBytes += len(data)
+		if self.batchSize >= FLUSH_SIZE:
+			self.handOff()
+
+	# hands the batch to the writer and waits until everything handed off so
+	# far is on disk
+	def flush(self):
+		if self.closed: return
+		self.handOff()
+		if self.thread:
+			done = threading.Event()
+			self.enqueue(done)
+			self.waitFor(done)
+		else:
+			self.flushOut()
+
+	# closes out once everything handed off has been written, and then calls
+	# onClosed(data) if given. unless wait is set the game thread doesnt wait
+	# for either, onClosed is called from the writer thread then.
+	def close(self, wait=True, onClosed=None, data=None):
+		if self.closed: return
+		self.handOff()
+		self.closed = True
+		self.flushCall.cancel()
+
+		if self.thread:
+			done = threading.Event()
+			self.enqueue((done, onClosed, data))
+			if not wait and not done.isSet():
+				# the counts are reported from the game thread once the writer
+				# thread is done
+				self.reportCall = bf2.scheduler.schedule(self.onReportTimer, FLUSH_INTERVAL, done, FLUSH_INTERVAL)
+				return
+			self.waitFor(done)
+		else:
+			self.closeOut(onClosed, data)
+
+		self.report()
+
+	def onReportTimer(self, done):
+		if not done.isSet(): return
+		self.reportCall.cancel()
+		self.report()
+
+	# the writer thread doesnt print, drops and errors are reported here
+	def report(self):
+		if self.numDropped:
+			print "Log writer dropped %d records" % self.numDropped
+		if self.numErrors:
+			print "Log writer failed to write %d batches" % self.numErrors
+
+	def onFlushTimer(self, data):
+		self.handOff()
+
+	def handOff(self):
+		if not self.batch: return
+		batch = self.batch
+		self.batch = []
+		self.batchSize = 0
+
+		self.checkThread()
+		if not self.thread:
+			self.writeOut(batch)
+		elif self.policy == POLICY_DROP:
+			try:
+				self.queue.put_nowait(batch)
+			except Queue.Full:
+				self.numDropped += len(batch)
+		else:
+			self.enqueue(batch)
+
+	# queues item for the writer thread. if the thread is gone the item is
+	# handled here instead of waiting for room that never comes.
+	def enqueue(self, item):
+		while self.running:
+			try:
+				self.queue.put(item, 1, FLUSH_INTERVAL)
+				return
+			except Queue.Full:
+				pass
+		self.checkThread()
+		self.process(item)
+
+	# waits until the writer thread has handled done, or is gone
+	def waitFor(self, done):
+		while not done.isSet():
+			if not self.running:
+				self.checkThread()
+				return
+			done.wait(FLUSH_INTERVAL)
+
+	# switches to writing on the game thread once the writer thread is gone,
+	# after handling whatever it left in the queue
+	def checkThread(self):
+		if not self.thread or self.running: return
+		self.thread = None
+		while 1:
+			try:
+				item = self.queue.get_nowait()
+			except Queue.Empty:
+				break
+			self.process(item)
+
+	# the writer thread. errors are counted and dont stop it, only the close
+	# item does.
+	def run(self):
+		try:
+			while 1:
+				item = self.queue.get()
+				try:
+					self.process(item)
+				except Exception:
+					self.numErrors += 1
+				if type(item) == tuple: return
+		finally:
+			self.running = 0
+
+	# a batch is a list of records, an event is set once everything queued
+	# before it has been flushed. a (event, onClosed, data) tuple closes out.
+	def process(self, item):
+		if type(item) == list:
+			self.writeOut(item)
+		elif type(item) == tuple:
+			done, onClosed, data = item
+			try:
+				self.closeOut(None, None)
+			finally:
+				done.set()
+			if onClosed: onClosed(data)
+		else:
+			try:
+				self.flushOut()
+			finally:
+				item.set()
+
+	def writeOut(self, batch):
+		try:
+			self.out.write("".join(batch))
+		except Exception:
+			self.numErrors += 1
+
+	def flushOut(self):
+		try:
+			self.out.flush()
+		except Exception:
+			pass
+
+	def closeOut(self, onClosed, data):
+		try:
+			self.out.close()
+		except Exception:
+			self.numErrors += 1
+		if onClosed: onClosed(data)
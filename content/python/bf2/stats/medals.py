@@ -0,0 +1,205 @@
+# medal awarding.
+#
+# award criteria are declared as data in medalRules and compiled at load time
+# into a list of the fields they read and, for every field, the rules reading
+# it. checking a player re-reads its fields, and only the rules of fields whose
+# value changed since the last check are evaluated. script score fields are
+# not even read unless PlayerScore.changedSince() reports them.
+
+import host
+import bf2
+import bf2.PlayerManager
+import bf2.stats.stats
+from bf2.stats.constants import *
+from bf2 import g_debug
+
+# seconds between award checks of all players
+CHECK_INTERVAL = 15.0
+
+# award criteria, as (medal id, medal value, conditions). a medal is awarded
+# once per round, when every condition holds. a condition is (field, minimum),
+# where a field is one of:
+#
+#   ("score", name)			a PlayerScore counter
+#   ("stats", name)			a PlayerStat attribute, like timePlayed
+#   (table, type, name)			a counter of a kits, vehicles or weapons
+#					table entry
+medalRules = (
+	# combat badges
+	(1031119, 1, ((("kits", KIT_TYPE_ASSAULT, "kills"), 5),)),
+	(1031120, 1, ((("kits", KIT_TYPE_AT, "kills"), 5),)),
+	(1031109, 1, ((("kits", KIT_TYPE_SNIPER, "kills"), 5),)),
+	(1031115, 1, ((("kits", KIT_TYPE_SPECOPS, "kills"), 5),)),
+	(1031121, 1, ((("kits", KIT_TYPE_SUPPORT, "kills"), 5),)),
+	(1031105, 1, ((("kits", KIT_TYPE_ENGINEER, "kills"), 5),)),
+	(1031113, 1, ((("kits", KIT_TYPE_MEDIC, "kills"), 5),)),
+	(1031406, 1, ((("weapons", WEAPON_TYPE_KNIFE, "kills"), 7),)),
+	(1031619, 1, ((("weapons", WEAPON_TYPE_PISTOL, "kills"), 5),)),
+
+	# service badges
+	(1190601, 1, ((("score", "heals"), 5), (("stats", "timePlayed"), 300))),
+	(1190507, 1, ((("score", "repairs"), 5), (("stats", "timePlayed"), 300))),
+	(1191819, 1, ((("score", "ammos"), 5), (("stats", "timePlayed"), 300))),
+	(1191319, 1, ((("stats", "timeAsCmd"), 600), (("score", "score"), 20))),
+)
+
+checkCall = None
+
+
+
+def compileRules(rules):
+	fields = []
+	fieldIndex = {}
+	rulesByField = []
+	compiled = []
+
+	for medalId, value, conditions in rules:
+		compiledConditions = []
+		for field, minimum in conditions:
+			if not field in fieldIndex:
+				fieldIndex[field] = len(fields)
+				fields.append(field)
+				rulesByField.append([])
+			compiledConditions.append((fieldIndex[field], minimum))
+
+		rule = (len(compiled), medalId, value, tuple(compiledConditions))
+		compiled.append(rule)
+		for i, minimum in compiledConditions:
+			if not rule in rulesByField[i]:
+				rulesByField[i].append(rule)
+
+	# script score fields are found through the change mask of the score
+	scoreMasks = [0] * len(fields)
+	for i in range(len(fields)):
+		if fields[i][0] == "score" and fields[i][1] in bf2.PlayerManager.scoreBits:
+			scoreMasks[i] = bf2.PlayerManager.scoreBits[fields[i][1]]
+
+	return tuple(fields), rulesByField, scoreMasks
+
+fields, rulesByField, scoreMasks = compileRules(medalRules)
+
+
+
+def readField(player, field):
+	if field[0] == "score":
+		return getattr(player.score, field[1])
+	elif field[0] == "stats":
+		return getattr(player.stats, field[1])
+	else:
+		return getattr(getattr(player.stats, field[0])[field[1]], field[2])
+
+
+
+class MedalSet:
+	"""Medals of a player in the current round, and the field values they were
+	last checked against."""
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.awarded = {}
+		self.values = [None] * len(fields)
+		self.scoreToken = None
+
+	# snapshot keys of the awarded medals
+	def getSnapshotKeys(self):
+		return [(str(medalId), value) for medalId, value in self.awarded.itervalues()]
+
+
+
+def init():
+	global checkCall
+
+	host.registerHandler('PlayerConnect', onPlayerConnect, 1)
+	host.registerHandler('Reset', onReset, 1)
+	host.registerGameStatusHandler(onGameStatusChanged)
+
+	# awards must be in before the snapshot is taken
+	bf2.stats.stats.registerEndOfRoundHandler(onEndOfRound, True)
+
+	checkCall = bf2.scheduler.schedule(onCheck, CHECK_INTERVAL, None, CHECK_INTERVAL)
+
+	# connect already connected players if reinitializing
+	for p in bf2.playerManager.getPlayers():
+		onPlayerConnect(p)
+
+	if g_debug: print "Medal awarding module initialized."
+
+
+
+def onPlayerConnect(player):
+	# player objects are reused for new players on the same index, so the set
+	# is never kept from a previous connection
+	player.medals = MedalSet()
+
+	# a player rejoining the round keeps the medals already awarded to them
+	playerStat = getattr(player, 'stats', None)
+	if playerStat != None and playerStat.medals != None:
+		player.medals.awarded.update(playerStat.medals.awarded)
+
+
+
+def onGameStatusChanged(status):
+	if status == bf2.GameStatus.Playing:
+		for p in bf2.playerManager.getPlayers():
+			p.medals = MedalSet()
+
+
+
+# scores and stats are zeroed without their change serials moving, so the
+# values the medals were checked against are dropped along with the awards
+def onReset(data):
+	for p in bf2.playerManager.getPlayers():
+		p.medals = MedalSet()
+
+
+
+def onCheck(data):
+	for p in bf2.playerManager.getPlayers():
+		checkPlayer(p)
+
+
+
+def onEndOfRound():
+	for p in bf2.playerManager.getPlayers():
+		checkPlayer(p)
+
+
+
+def checkPlayer(player):
+	medals = getattr(player, 'medals', None)
+	if medals == None or getattr(player, 'stats', None) == None: return
+
+	# fields whose value changed since the last check
+	values = medals.values
+	if medals.scoreToken == None:
+		changedMask = -1
+	else:
+		changedMask = player.score.changedSince(medals.scoreToken)
+	medals.scoreToken = player.score.checkpoint()
+
+	candidates = {}
+	for i in range(len(fields)):
+		if scoreMasks[i] and values[i] != None and not changedMask & scoreMasks[i]:
+			continue
+
+		value = readField(player, fields[i])
+		if value == values[i]: continue
+		values[i] = value
+
+		for rule in rulesByField[i]:
+			if not rule[0] in medals.awarded:
+				candidates[rule[0]] = rule
+
+	for ruleId, medalId, value, conditions in candidates.itervalues():
+		for i, minimum in conditions:
+			if values[i] < minimum: break
+		else:
+			award(player, ruleId, medalId, value)
+
+
+
+def award(player, ruleId, medalId, value):
+	player.medals.awarded[ruleId] = (medalId, value)
+	if g_debug: print "Awarding medal %d to player %d" % (medalId, player.index)
+	bf2.gameLogic.sendMedalEvent(player, medalId, value)
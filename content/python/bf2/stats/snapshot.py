@@ -0,0 +1,249 @@
+# end of round snapshot.
+#
+# serializes the session stats into the backslash delimited key/value format
+# taken by the stats backend: a header with round keys, the keys of every
+# player suffixed with _<n>, and a closing EOF key. ranked servers send it to
+# the backend.
+#
+# snapshots can also be written to <modDir>/Logs for testing without a stats
+# backend. enable by typing this in the console:
+# pythonHost.sendCommand snapfile 1
+
+import host
+import time
+import string
+import bf2
+import bf2.stats.stats
+from bf2.stats.constants import *
+from bf2 import g_debug
+
+try:
+	import cStringIO as StringIO
+except ImportError:
+	import StringIO
+
+fileSink = 0
+mapStart = 0
+
+# player keys taken from PlayerStat attributes
+playerKeys = (
+	("pID",		"profileId"),
+	("t",		"team"),
+	("ctime",	"timeOnLine"),
+	("c",		"complete"),
+	("rs",		"score"),
+	("cs",		"cmdScore"),
+	("ss",		"skillScore"),
+	("ts",		"teamScore"),
+	("kills",	"kills"),
+	("deaths",	"deaths"),
+	("tk",		"teamkills"),
+	("rank",	"rank"),
+	("ban",		"timesBanned"),
+	("kck",		"timesKicked"),
+	("klstrk",	"longestKillStreak"),
+	("dstrk",	"longestDeathStreak"),
+	("bf",		"bulletsFired"),
+	("bh",		"bulletsHit"),
+	("tt",		"timePlayed"),
+	("tco",		"timeAsCmd"),
+	("tsl",		"timeAsSql"),
+	("tsm",		"timeInSquad"),
+)
+
+# player keys taken from the script scores
+scoreKeys = (
+	("heal",	"heals"),
+	("rviv",	"revives"),
+	("rsup",	"ammos"),
+	("rpar",	"repairs"),
+	("tdmg",	"teamDamages"),
+	("tdrv",	"teamVehicleDamages"),
+	("suic",	"suicides"),
+	("cpt",		"cpCaptures"),
+	("cpa",		"cpAssists"),
+	("dcpt",	"cpDefends"),
+	("cpn",		"cpNeutralizes"),
+	("cpna",	"cpNeutralizeAssists"),
+	("ka",		"damageAssists"),
+	("pa",		"passengerAssists"),
+	("tga",		"targetAssists"),
+	("da",		"driverAssists"),
+	("ds",		"driverSpecials"),
+)
+
+# per type keys of the vehicle, kit and weapon tables. entries of types that
+# were never used are left out.
+vehicleKeys = (("tv", "timeInObject"), ("kv", "kills"), ("bv", "deaths"), ("kvr", "roadKills"))
+kitKeys = (("tk", "timeInObject"), ("kk", "kills"), ("dk", "deaths"))
+weaponKeys = (("tw", "timeInObject"), ("kw", "kills"), ("bw", "deaths"), ("fw", "bulletsFired"), ("hw", "bulletsHit"), ("de", "deployed"))
+
+
+
+def init():
+	host.registerHandler('ConsoleSendCommand', onSendCommand)
+	host.registerGameStatusHandler(onGameStatusChanged)
+	bf2.stats.stats.registerEndOfRoundHandler(invoke)
+
+	sendRecoveredRound()
+
+	if g_debug: print "Snapshot module initialized."
+
+
+
+def onSendCommand(command, args):
+	global fileSink
+
+	if string.lower(command) == "snapfile":
+		if len(args) > 0:
+			fileSink = args[0] == "1"
+
+
+
+def onGameStatusChanged(status):
+	global mapStart
+
+	if status == bf2.GameStatus.Playing:
+		mapStart = time.time()
+
+
+
+def invoke():
+	statsMap = bf2.stats.stats.getStatsMap()
+	header = getRoundHeader(bf2.gameLogic.getMapName(), mapStart, time.time())
+	header["win"] = bf2.gameLogic.getWinner()
+	for team in (1, 2):
+		header["ra%d" % team] = armyOf(bf2.stats.stats.roundArmies[team])
+		header["rs%d" % team] = bf2.gameLogic.getTickets(team)
+	send(bf2.gameLogic.getMapName(), getSnapshot(header, statsMap))
+
+
+
+# a round cut short by a crash, rebuilt from the stats journal
+def sendRecoveredRound():
+	try:
+		import bf2.stats.journal
+	except ImportError:
+		return
+
+	recovered = bf2.stats.journal.getRecoveredRound()
+	if not recovered: return
+
+	(mapName, startTime), statsMap = recovered
+	print "Sending snapshot of recovered round on", mapName
+	header = getRoundHeader(mapName, startTime, time.time())
+	header["rec"] = 1
+	send(mapName, getSnapshot(header, statsMap))
+
+
+
+def send(mapName, snapshot):
+	if host.ss_getParam('ranked'):
+		if g_debug: print "Sending snapshot, %d bytes" % len(snapshot)
+		host.pers_gamespySendSnapshot(snapshot)
+
+	if fileSink:
+		dateString = time.strftime("%y%m%d_%H%M", time.localtime())
+		fileName = bf2.gameLogic.getModDir() + "/Logs/" + mapName + "_" + dateString + "_snapshot.txt"
+		try:
+			f = open(fileName, "w")
+			f.write(snapshot)
+			f.close()
+		except IOError:
+			print "Couldnt write snapshot file: ", fileName
+
+
+
+def getRoundHeader(mapName, startTime, endTime):
+	header = {
+		"m"		: getMapId(mapName),
+		"gm"		: getGameModeId(bf2.serverSettings.getGameMode()),
+		"mapstart"	: int(startTime),
+		"mapend"	: int(endTime),
+	}
+	return header
+
+
+
+def getSnapshot(header, statsMap):
+	buffer = StringIO.StringIO()
+	encoder = SnapshotEncoder(buffer)
+
+	keys = header.keys()
+	keys.sort()
+	for key in keys:
+		encoder.write(key, header[key])
+	encoder.write("pc", len(statsMap))
+
+	nrs = statsMap.keys()
+	nrs.sort()
+	for n, nr in enumerate(nrs):
+		writePlayer(encoder, statsMap[nr], n, statsMap)
+
+	encoder.write("EOF", 1)
+	return buffer.getvalue()
+
+
+
+class SnapshotEncoder:
+	"""Writes key/value pairs straight to a file-like object as they come."""
+	def __init__(self, out):
+		self.out = out
+
+	def write(self, key, value):
+		self.out.write("\\%s\\%s" % (key, value))
+
+	# writes the attributes of obj named in keys, suffixed with suffix
+	def writeKeys(self, obj, keys, suffix):
+		write = self.out.write
+		for key, name in keys:
+			write("\\%s%s\\%s" % (key, suffix, intOf(getattr(obj, name))))
+
+
+
+def writePlayer(encoder, sp, n, statsMap):
+	suffix = "_%d" % n
+	encoder.write("name" + suffix, escape(sp.name))
+	encoder.write("ip" + suffix, escape(sp.ipaddr))
+	encoder.write("a" + suffix, armyOf(getattr(sp, 'army', None)))
+	encoder.writeKeys(sp, playerKeys, suffix)
+	encoder.writeKeys(sp.localScore, scoreKeys, suffix)
+
+	for a in range(0, NUM_ARMIES):
+		armyTime = int(sp.getTimeAsArmy(a))
+		if armyTime: encoder.write("ta%d%s" % (a, suffix), armyTime)
+
+	for table, keys in ((sp.vehicles, vehicleKeys), (sp.kits, kitKeys), (sp.weapons, weaponKeys)):
+		for t, stat in table.iteritems():
+			if not stat.timeInObject and not stat.kills and not stat.deaths: continue
+			encoder.writeKeys(stat, keys, "%d%s" % (t, suffix))
+
+	if sp.medals:
+		for key, value in sp.medals.getSnapshotKeys():
+			encoder.write(key + suffix, value)
+
+	# top victim and nemesis
+	kills = sp.store.kills
+	for key, top in (("mv", kills.getTopVictim(sp.connectionOrderNr)), ("vm", kills.getTopAttacker(sp.connectionOrderNr))):
+		if not top: continue
+		count, nr = top
+		if nr in statsMap:
+			encoder.write(key + "ns" + suffix, statsMap[nr].profileId)
+			encoder.write(key + "ks" + suffix, count)
+
+
+
+def armyOf(army):
+	if army == None: return ARMY_UNKNOWN
+	return army
+
+
+
+def intOf(value):
+	if type(value) == float: return int(value)
+	return value
+
+
+
+def escape(value):
+	return str(value).replace("\\", "")
@@ -1,4 +1,7 @@
 import host
+import time
+import array
+import bf2.Scheduler
 import bf2.PlayerManager
 import fpformat
 from constants import *
@@ -36,6 +39,30 @@ def getStatsMap():
 def setStatsMap(map):
 	global sessionPlayerStatsMap
 	sessionPlayerStatsMap = map
+	rebuildProfileMap()
+
+
+
+# profileId -> PlayerStat for every record in sessionPlayerStatsMap with a profile
+sessionPlayerProfileMap = {}
+def rebuildProfileMap():
+	sessionPlayerProfileMap.clear()
+	for stats in sessionPlayerStatsMap.itervalues():
+		if stats.profileId > 0:
+			sessionPlayerProfileMap[stats.profileId] = stats
+
+
+
+# called with no arguments at the end of a round, once all players have been
+# finalized and before the session stats of unranked rounds are cleared.
+# handlers registered with first set run before all others.
+endOfRoundHandlers = []
+def registerEndOfRoundHandler(handler, first=False):
+	if handler in endOfRoundHandlers: return
+	if first:
+		endOfRoundHandlers.insert(0, handler)
+	else:
+		endOfRoundHandlers.append(handler)
 
 
 
@@ -50,66 +77,92 @@ def init():
 	
 	
 
+# round event handlers, registered once on the first round start
+roundHandlers = (
+	('PlayerKilled', 'onPlayerKilled'),
+	('PlayerDeath', 'onPlayerDeath'),
+	('EnterVehicle', 'onEnterVehicle'),
+	('ExitVehicle', 'onExitVehicle'),
+	('PickupKit', 'onPickupKit'),
+	('DropKit', 'onDropKit'),
+	('PlayerChangedSquad', 'onPlayerChangedSquad'),
+	('ChangedCommander', 'onChangedCommander'),
+	('ChangedSquadLeader', 'onChangedSquadLeader'),
+	('PlayerChangeWeapon', 'onPlayerChangeWeapon'),
+	('PlayerBanned', 'onPlayerBanned'),
+	('PlayerKicked', 'onPlayerKicked'),
+	('PlayerSpawn', 'onPlayerSpawn'),
+	('DeployGrapplingHook', 'onDeployGrapplingHook'),
+	('DeployZipLine', 'onDeployZipLine'),
+	('DeployTactical', 'onDeployTactical'),
+)
+roundHandlersRegistered = False
+
+def registerRoundHandlers():
+	global roundHandlersRegistered
+	if roundHandlersRegistered: return
+	roundHandlersRegistered = True
+
+	for event, name in roundHandlers:
+		host.registerHandler(event, globals()[name])
+
+
+
+# round start work that can wait, like resetting the records of departed
+# players. it is run in slices of at most ROUND_WORK_BUDGET seconds, every
+# ROUND_WORK_INTERVAL seconds.
+ROUND_WORK_BUDGET = 0.002
+ROUND_WORK_INTERVAL = 0.1
+
+roundStartWork = bf2.Scheduler.WorkQueue("Round start work", bf2.scheduler, ROUND_WORK_BUDGET, ROUND_WORK_INTERVAL)
+
+
+
 def onGameStatusChanged(status):
 	if status == bf2.GameStatus.Playing:
+		start = time.time()
 
-		# find highest player still connected
-		highestPid = -1
-		for pid in sessionPlayerStatsMap:
-			if pid > highestPid:
-				highestPid = pid
-		
+		# continue after the highest player still connected
 		global playerConnectionOrderIterator
-		playerConnectionOrderIterator = highestPid + 1
+		if sessionPlayerStatsMap:
+			playerConnectionOrderIterator = max(sessionPlayerStatsMap.keys()) + 1
+		else:
+			playerConnectionOrderIterator = 0
 		print "Reset orderiterator to %d based on highest pid kept" % playerConnectionOrderIterator
 
-		# Reconnect players
-		#if len(sessionPlayerStatsMap) == 0:
-			#print("Reloading players");
-		for p in bf2.playerManager.getPlayers():
+		# reconnect players
+		players = bf2.playerManager.getPlayers()
+		for p in players:
 			onPlayerConnect(p)
 	
-		global army
 		roundArmies[1] = getArmy(bf2.gameLogic.getTeamName(1))
 		roundArmies[2] = getArmy(bf2.gameLogic.getTeamName(2))
 
-		# All other hooks	
-		host.registerHandler('PlayerKilled', onPlayerKilled)
-		host.registerHandler('PlayerDeath', onPlayerDeath)
-		host.registerHandler('EnterVehicle', onEnterVehicle)
-		host.registerHandler('ExitVehicle', onExitVehicle)
-		host.registerHandler('PickupKit', onPickupKit)
-		host.registerHandler('DropKit', onDropKit)
-		host.registerHandler('PlayerChangedSquad', onPlayerChangedSquad)
-		host.registerHandler('ChangedCommander', onChangedCommander)
-		host.registerHandler('ChangedSquadLeader', onChangedSquadLeader)
-		host.registerHandler('PlayerChangeWeapon', onPlayerChangeWeapon)
-		host.registerHandler('PlayerBanned', onPlayerBanned)
-		host.registerHandler('PlayerKicked', onPlayerKicked)
-		host.registerHandler('PlayerSpawn', onPlayerSpawn)
-		host.registerHandler('DeployGrapplingHook', onDeployGrapplingHook)
-		host.registerHandler('DeployZipLine', onDeployZipLine)
-		host.registerHandler('DeployTactical', onDeployTactical)
-
-		for s in sessionPlayerStatsMap.itervalues():
-			s.reset()
+		registerRoundHandlers()
 
-		for p in bf2.playerManager.getPlayers():
-			p.stats.reinit(p)
-			p.stats.wasHereAtStart = 1
+		resetSession(players, True)
 			
 		bf2.playerManager.enableScoreEvents()
 
 		# stats have all been cleared enable next end of round stats
 		setSendEndOfRoundStats( True )
 
+		print "Round start stats reset of %d records took %.1f ms, %d deferred" % (len(sessionPlayerStatsMap),
+			(time.time() - start) * 1000, roundStartWork.getNumberOfPending())
+
 
 	elif status == bf2.GameStatus.EndGame:
 
+		# records must be complete before they are finalized and sent
+		roundStartWork.flush()
+
 		# finalize stats and send snapshot
 		for p in bf2.playerManager.getPlayers():
 			p.stats.wasHereAtEnd = 1
 			finalizePlayer(p)
+
+		for handler in endOfRoundHandlers:
+			handler()
 			
 		# check ensure we only send the end of round stats once
 		if getSendEndOfRoundStats():
@@ -121,6 +174,8 @@ def onGameStatusChanged(status):
 		if not host.ss_getParam('ranked'):
 			playerConnectionOrderIterator = 0
 			sessionPlayerStatsMap.clear()
+			sessionPlayerProfileMap.clear()
+			sessionStore.clear()
 			if( (host.ss_getParam('gameMode') == "gpm_coop") or (host.ss_getParam('gameMode') == "sp1") ):
    					for p in bf2.playerManager.getPlayers():
    						if not p.isAIPlayer():
@@ -130,23 +185,79 @@ def onGameStatusChanged(status):
 	
 	
 def onReset(data):
+	resetSession(bf2.playerManager.getPlayers())
+
+
+
+# resets all session records for a new round. the store columns and the kill
+# matrix are zeroed in one go. records of departed players are reset in the
+# round start work queue if deferred, or right away.
+def resetSession(players, deferred=False):
+	now = date()
+	roundStartWork.clear()
+	sessionStore.zeroAll()
+
+	connected = {}
+	for p in players:
+		connected[id(p.stats)] = p
+
 	for s in sessionPlayerStatsMap.itervalues():
-		s.reset()
+		if s.store is not sessionStore:
+			s.reset(now)
+		elif deferred and not id(s) in connected:
+			s.resetPending = True
+			roundStartWork.add(resetDeparted, s)
+		else:
+			s.resetFields(now)
 
-	for p in bf2.playerManager.getPlayers():
+	for p in players:
 		p.stats.reinit(p)
 		p.stats.wasHereAtStart = 1
+
+
+
+def resetDeparted(stats):
+	if stats.resetPending:
+		stats.resetFields()
 	
 	
-	
-class PlayerStat: 
+# ingame scores copied by PlayerStat.copyPlayerData, in assignment order
+copiedScores = ('score', 'cmdScore', 'rplScore', 'skillScore', 'kills', 'TKs', 'deaths', 'rank')
+
+# PlayerStat counters kept in session store columns
+playerStatCounters = ('score', 'cmdScore', 'teamScore', 'skillScore', 'kills', 'teamkills', 'deaths', 'bulletsFired', 'bulletsHit')
+
+# script scores copied into session store columns for the end-of-round summary
+sessionScores = ('cpCaptures', 'cpAssists', 'cpDefends', 'damageAssists', 'targetAssists', 'passengerAssists', 'heals', 'revives',
+		'ammos', 'repairs', 'driverSpecials', 'driverAssists')
+
+# intervals timed per player, as time -> (total, start) attributes. an interval
+# is open while its start time is set. totals are only added to when it is
+# closed, reading a time adds the open part without storing anything.
+playerTimes = {
+	'timePlayed'	: ('rawTimePlayed', 'spawnedAt'),
+	'timeAsCmd'	: ('rawTimeAsCmd', 'becameCmdAt'),
+	'timeAsSql'	: ('rawTimeAsSql', 'becameSqlAt'),
+	'timeInSquad'	: ('rawTimeInSquad', 'joinedSquadAt'),
+}
+
+class PlayerStat(object): 
 	def __init__(self, player):
 		self.profileId = player.getProfileId()
 		self.playerId = player.index
 		self.id = self.playerId
-		self.connectionOrderNr = 0
+		self.connectionOrderNr = None
 		self.rank = 0
 		
+		# a player keeps the store it was created in, so records that outlive
+		# a store clear never share rows with new ones
+		self.store = sessionStore
+		self.row = sessionStore.allocate()
+		self.columns = sessionStore.columns
+		self.vehicles = sessionStore.getTable('vehicles', VehicleStat, self.row)
+		self.weapons = sessionStore.getTable('weapons', WeaponStat, self.row)
+		self.kits = sessionStore.getTable('kits', KitStat, self.row)
+
 		self.reinit(player)
 		self.reset()
 
@@ -155,48 +266,28 @@ class PlayerStat:
 		self.ipaddr = player.getAddress()
 		self.localScore = player.score		
 	
-	def reset(self):
-		self.connectAt = date()
-		self.timeOnLine = 0
-		
-		self.score 	= 0
-		self.cmdScore 	= 0
-		self.teamScore 	= 0
-		self.skillScore = 0
-		self.kills 	= 0
-		self.teamkills 	= 0
-		self.deaths 	= 0
-				
-		self.vehicles = {}
-		for v in range(0, NUM_VEHICLE_TYPES + 1):
-			if not v in self.vehicles:
-				self.vehicles[v] = VehicleStat(v)
-			else:
-				self.vehicles[v].reset()
-	
-		self.weapons = {}
-		for w in range(0, NUM_WEAPON_TYPES + 1):
-			if not w in self.weapons:
-				self.weapons[w] = WeaponStat(w)
-			else:
-				self.weapons[w].reset()
-	
-		self.kits = {}
-		for k in range(0, NUM_KIT_TYPES + 1):
-			if not k in self.kits:
-				self.kits[k] = KitStat(k)
-			else:			
-				self.kits[k].reset()
+	def reset(self, now=None):
+		# zeroes score, kills, deaths, bullet counts and the vehicle, weapon
+		# and kit tables, which all live in the session store
+		self.store.zeroRow(self.row)
 	
-		self.killedByPlayer = {}
-		self.killedPlayer = {}
+		if self.connectionOrderNr != None:
+			self.store.kills.clearPlayer(self.connectionOrderNr)
+
+		self.resetFields(now)
+
+	# resets everything not kept in the session store
+	def resetFields(self, now=None):
+		if now == None: now = date()
+		self.connectAt = now
+		self.timeOnLine = 0
+		self.resetPending = False
 
 		self.team = 0
 
 		self.localScore.reset()
 		
-		self.bulletsFired = 0
-		self.bulletsHit = 0
+		self.resetBullets()
 
 		self.currentKillStreak = 0
 		self.longestKillStreak = 0
@@ -228,37 +319,61 @@ class PlayerStat:
 		self.lastWeaponType = NUM_WEAPON_TYPES
 		self.lastVehicleType = NUM_VEHICLE_TYPES
 
-	def __getattr__(self, name):
-		if name in self.__dict__: return self.__dict__[name]
-		elif name == 'timePlayed':
-			if self.spawnedAt:
-				timeDiff = date() - self.spawnedAt
-				self.rawTimePlayed += timeDiff
-				self.timeAsArmy[roundArmies[self.spawnedTeam]] += timeDiff
-				self.spawnedAt = date()
-			return self.rawTimePlayed
-		elif name == 'timeAsCmd':
-			if self.becameCmdAt:
-				self.rawTimeAsCmd += date() - self.becameCmdAt 
-				self.becameCmdAt = date()
-			return self.rawTimeAsCmd
-		elif name == 'timeAsSql':
-			if self.becameSqlAt:
-				self.rawTimeAsSql += date() - self.becameSqlAt 
-				self.becameSqlAt = date()
-			return self.rawTimeAsSql
-		elif name == 'timeInSquad':
-			if self.joinedSquadAt:
-				self.rawTimeInSquad += date() - self.joinedSquadAt 
-				self.joinedSquadAt = date()
-			return self.rawTimeInSquad
-		elif name == 'accuracy':
-			if self.bulletsFired == 0:
-				return 0
-			else:
-				return 1.0 * self.bulletsHit / self.bulletsFired
+	# forgets the collected bullet counts, the engine counts are taken from
+	# scratch by the next collection
+	def resetBullets(self):
+		self.bulletsFiredSeen = {}
+		self.bulletsHitSeen = {}
+		self.lifeBulletsFired = 0
+		self.lifeBulletsHit = 0
+		self.lifeKitBulletsFired = 0
+		self.lifeKitBulletsHit = 0
+		self.tempWeapons = {}
+		self.tempKits = {}
+		self.tempVehicles = {}
+
+	# time spent in an interval of playerTimes up to now, open part included
+	def getTime(self, name, now=None):
+		total, start = playerTimes[name]
+		startedAt = getattr(self, start)
+		if not startedAt: return getattr(self, total)
+		if now == None: now = date()
+		return getattr(self, total) + now - startedAt
+
+	def stopTime(self, name, now=None):
+		total, start = playerTimes[name]
+		startedAt = getattr(self, start)
+		if not startedAt: return
+		if now == None: now = date()
+		setattr(self, total, getattr(self, total) + now - startedAt)
+		setattr(self, start, 0)
+
+	def getTimeAsArmy(self, army, now=None):
+		time = self.timeAsArmy[army]
+		if self.spawnedAt and roundArmies[self.spawnedTeam] == army:
+			if now == None: now = date()
+			time += now - self.spawnedAt
+		return time
+
+	def getAccuracy(self):
+		if self.bulletsFired == 0:
+			return 0
 		else:
-			raise AttributeError, name
+			return 1.0 * self.bulletsHit / self.bulletsFired
+
+	# victims and attackers of this player, as connectionOrderNr -> kills
+	def getKilledPlayer(self):
+		return self.store.kills.getRow(self.connectionOrderNr)
+
+	def setKilledPlayer(self, kills):
+		self.store.kills.setRow(self.connectionOrderNr, kills)
+
+	def getKilledByPlayer(self):
+		return self.store.kills.getColumn(self.connectionOrderNr)
+
+	accuracy = property(getAccuracy)
+	killedPlayer = property(getKilledPlayer, setKilledPlayer)
+	killedByPlayer = property(getKilledByPlayer)
 						
 	# when same player rejoins server
 	def reconnect(self, player):
@@ -286,16 +401,17 @@ class PlayerStat:
 		
 	# calculate final stats values for this player (disconnected or end of round)
 	def finalize(self, player):
-		self.copyPlayerData(player)
+		now = date()
+		self.copyPlayerData(player, now)
 		
 		if self.currentWeaponType != NUM_WEAPON_TYPES:
-			self.weapons[self.currentWeaponType].exit(player)
+			self.weapons[self.currentWeaponType].exit(player, now)
 			self.currentWeaponType = NUM_WEAPON_TYPES
 
-		stopSpawned(player)	
-		stopInSquad(player)
-		stopAsSql(player)
-		stopAsCmd(player)
+		stopSpawned(player, now)	
+		stopInSquad(player, now)
+		stopAsSql(player, now)
+		stopAsCmd(player, now)
 		
 		if self.wasHereAtStart == 1 and self.wasHereAtEnd == 1:
 			self.complete = 1
@@ -305,33 +421,31 @@ class PlayerStat:
 		finalizeBulletsFired(player)
 			
 		for v in player.stats.vehicles.itervalues():
-			if v.enterAt != 0: v.exit(player)
+			if v.enterAt != 0: v.exit(player, now)
 		for v in player.stats.kits.itervalues():
-			if v.enterAt != 0: v.exit(player)
+			if v.enterAt != 0: v.exit(player, now)
 		for v in player.stats.weapons.itervalues():
-			if v.enterAt != 0: v.exit(player)
+			if v.enterAt != 0: v.exit(player, now)
 					
 	# copy data to player-stats, as player might not be awailable after this
-	def copyPlayerData(self, player):
-		self.timeOnLine += date() - self.connectAt
+	def copyPlayerData(self, player, now=None):
+		if now == None: now = date()
+		self.timeOnLine += now - self.connectAt
 
 		self.localScore = player.score
 		
-		self.score 	= player.score.score
-		self.cmdScore 	= player.score.cmdScore	
-		self.teamScore 	= player.score.rplScore
-		self.skillScore = player.score.skillScore
+		(self.score, self.cmdScore, self.teamScore, self.skillScore,
+		 self.kills, self.teamkills, self.deaths, self.rank) = player.score.read(copiedScores)
 
 		if self.score < 0: 	self.score = 0
 		if self.cmdScore < 0: 	self.cmdScore = 0
 		if self.teamScore < 0: 	self.teamScore = 0
 		if self.skillScore < 0: self.skillScore = 0
-				
-		self.kills 	= player.score.kills
-		self.teamkills 	= player.score.TKs
-		self.deaths 	= player.score.deaths
 
-		self.rank = player.score.rank
+		row = self.row
+		for name in sessionScores:
+			self.columns[name][row] = getattr(player.score, name)
+
 		self.army = roundArmies[player.getTeam()]
 		self.team = player.getTeam()
 		
@@ -341,98 +455,290 @@ class PlayerStat:
 			else:
 				if g_debug: print "Player had no medal stats. pid=", player.index
 
+
+
+def _playerStatProperty(name):
+	def get(self): return self.columns[name][self.row]
+	def set(self, value): self.columns[name][self.row] = value
+	return property(get, set)
+
+for name in playerStatCounters:
+	setattr(PlayerStat, name, _playerStatProperty(name))
+
+def _playerTimeProperty(name):
+	def get(self): return self.getTime(name)
+	return property(get)
+
+for name in playerTimes:
+	setattr(PlayerStat, name, _playerTimeProperty(name))
+del name
+
 			
 	
-class ObjectStat: 
-	def __init__(self, type):
-		self.reset()
+# per-type counters of vehicles, weapons and kits. each is stored in its own
+# column of an ObjectStatTable.
+objectStatCounters = ('kills', 'killedBy', 'deaths', 'score', 'bulletsFired', 'bulletsFiredTemp', 'bulletsHit', 'bulletsHitTemp',
+		'enterScore', 'deployed', 'roadKills')
+objectStatTimes = ('rawTimeInObject', 'enterAt')
+
+class ObjectStatTable:
+	"""Counters of one player for every vehicle, weapon or kit type. The counters
+	are a slice of the session store columns starting at base. Indexing returns
+	ObjectStat views onto a type, so the table can be used like the type -> stat
+	dict it replaces."""
+	def __init__(self, statClass, numTypes, columns, base):
+		self.numTypes = numTypes
+		self.columns = columns
+		self.base = base
+		self.stats = [statClass(self, t) for t in range(numTypes)]
+
+	def reset(self):
+		base = self.base
+		for column in self.columns.itervalues():
+			column[base:base + self.numTypes] = array.array(column.typecode, [0]) * self.numTypes
+
+	def __getitem__(self, type): return self.stats[type]
+	def __contains__(self, type): return 0 <= type < self.numTypes
+	def __len__(self): return self.numTypes
+	def __iter__(self): return iter(range(self.numTypes))
+
+	def keys(self): return range(self.numTypes)
+	def values(self): return list(self.stats)
+	def itervalues(self): return iter(self.stats)
+	def iteritems(self): return iter(zip(range(self.numTypes), self.stats))
+
+
+
+class ObjectStat(object): 
+	__slots__ = ('table', 'type', 'index')
+
+	def __init__(self, table, type):
+		self.table = table
 		self.type = type
+		self.index = table.base + type
 	
 	def reset(self):	
 		
 		# reset all non-global
-		self.kills = 0
-		self.killedBy = 0
-		self.rawTimeInObject = 0
-		self.deaths = 0
-		self.score = 0
-		self.bulletsFired = 0
-		self.bulletsFiredTemp = 0
-		self.bulletsHit = 0
-		self.bulletsHitTemp = 0
-		self.enterAt = 0
-		self.enterScore = 0	
-		self.deployed = 0
+		for column in self.table.columns.itervalues():
+			column[self.index] = 0
 		
-	def enter(self, player):
-		self.enterAt = date()
+	def enter(self, player, now=None):
+		if now == None: now = date()
+		self.enterAt = now
 		self.enterScore = player.score.score
 	
-	def exit(self, player):
+	def exit(self, player, now=None):
 		if self.enterAt == 0: return
-		time = self.timeInObject
+		if now == None: now = date()
+		self.rawTimeInObject += now - self.enterAt
 		self.enterAt = 0
 		
 		self.score += player.score.score - self.enterScore
 		self.enterScore = 0 
 		
-	def __getattr__(self, name):
-		if name in self.__dict__: return self.__dict__[name]
-		elif name == 'timeInObject' or name == 'rtime':
-			if self.enterAt:
-				self.rawTimeInObject += date() - self.enterAt
-				self.enterAt = date()
-			return self.rawTimeInObject
-		elif name == 'accuracy':
-			if self.bulletsFired == 0:
-				return 0
-			else:
-				return 1.0 * self.bulletsHit / self.bulletsFired
+	# reading never closes the interval, so the open part isnt stored
+	def getTimeInObject(self, now=None):
+		if not self.enterAt: return self.rawTimeInObject
+		if now == None: now = date()
+		return self.rawTimeInObject + now - self.enterAt
+
+	def getAccuracy(self):
+		if self.bulletsFired == 0:
+			return 0
 		else:
-			raise AttributeError, name
+			return 1.0 * self.bulletsHit / self.bulletsFired
+
+	timeInObject = property(getTimeInObject)
+	rtime = timeInObject
+	accuracy = property(getAccuracy)
+
+def _objectStatProperty(name):
+	def get(self): return self.table.columns[name][self.index]
+	def set(self, value): self.table.columns[name][self.index] = value
+	return property(get, set)
+
+for name in objectStatCounters + objectStatTimes:
+	setattr(ObjectStat, name, _objectStatProperty(name))
+del name
 		
 
 
 class VehicleStat(ObjectStat): 
-	def __init__(self, type):
-		ObjectStat.__init__(self, type)
-		self.reset()
-	
-	def reset(self):	
-		ObjectStat.reset(self)
-		self.roadKills = 0
+	__slots__ = ()
 		
 
 
 class KitStat(ObjectStat):
-	def __init__(self, type):
-		ObjectStat.__init__(self, type)
-		self.reset()
-	
-	def reset(self):
-		ObjectStat.reset(self)
+	__slots__ = ()
 
 
 
 class WeaponStat(ObjectStat):
-	def __init__(self, type):
-		ObjectStat.__init__(self, type)
-		self.reset()
+	__slots__ = ()
 		
-	def reset(self):
-		ObjectStat.reset(self)
-		
-	def enter(self, player):
+	def enter(self, player, now=None):
+		if now == None: now = date()
 		if player.stats.currentWeaponType != NUM_WEAPON_TYPES:
-			player.stats.weapons[player.stats.currentWeaponType].exit(player)
+			player.stats.weapons[player.stats.currentWeaponType].exit(player, now)
 		player.stats.currentWeaponType = self.type
 
-		ObjectStat.enter(self, player)
-	
-	def exit(self,player):
-		time = date() - self.enterAt
+		ObjectStat.enter(self, player, now)
 
-		ObjectStat.exit(self, player)
+
+
+
+class KillMatrix:
+	"""Kills between session players, by connectionOrderNr. The counts are kept
+	once, in a row per attacker. The column of a victim only lists its
+	attackers, so both views are available without storing counts twice."""
+	def __init__(self):
+		self.rows = {}
+		self.columns = {}
+
+	def add(self, attacker, victim, count=1):
+		row = self.rows.setdefault(attacker, {})
+		if victim in row:
+			row[victim] += count
+		else:
+			row[victim] = count
+			self.columns.setdefault(victim, []).append(attacker)
+
+	# victim -> kills of an attacker. the dict is the matrix row, dont modify it
+	def getRow(self, attacker):
+		return self.rows.get(attacker, {})
+
+	def setRow(self, attacker, kills):
+		self.clearRow(attacker)
+		for victim, count in kills.iteritems():
+			self.add(attacker, victim, count)
+
+	# attacker -> kills of a victim
+	def getColumn(self, victim):
+		rows = self.rows
+		return dict([(attacker, rows[attacker][victim]) for attacker in self.columns.get(victim, ())])
+
+	# (kills, victim) of the player an attacker killed most, or None
+	def getTopVictim(self, attacker):
+		row = self.rows.get(attacker)
+		if not row: return None
+		return max([(count, victim) for victim, count in row.iteritems()])
+
+	# (kills, attacker) of the player that killed a victim most, or None
+	def getTopAttacker(self, victim):
+		attackers = self.columns.get(victim)
+		if not attackers: return None
+		rows = self.rows
+		return max([(rows[attacker][victim], attacker) for attacker in attackers])
+
+	# all (attacker, victim, kills) entries
+	def iterKills(self):
+		for attacker, row in self.rows.iteritems():
+			for victim, count in row.iteritems():
+				yield attacker, victim, count
+
+	def clearRow(self, attacker):
+		row = self.rows.pop(attacker, None)
+		if not row: return
+		for victim in row:
+			attackers = self.columns[victim]
+			attackers.remove(attacker)
+			if not attackers: del self.columns[victim]
+
+	# forgets the kills of and on a player
+	def clearPlayer(self, nr):
+		self.clearRow(nr)
+		for attacker in self.columns.pop(nr, ()):
+			row = self.rows[attacker]
+			del row[nr]
+			if not row: del self.rows[attacker]
+
+	def clear(self):
+		self.rows.clear()
+		self.columns.clear()
+
+
+
+# rows added to the session store columns whenever they run full
+STORE_GROW_ROWS = 16
+
+class SessionStatStore:
+	"""Stats of all session players, one array per counter with a row for every
+	PlayerStat. The vehicle, weapon and kit tables are stored the same way, with
+	numTypes consecutive entries per row. Rankings over all players are taken
+	straight from the columns (see bf2.stats.endofround)."""
+	def __init__(self):
+		self.clear()
+
+	# starts a new session. records created before keep their old columns.
+	def clear(self):
+		self.numRows = 0
+		self.capacity = 0
+		self.columns = {}
+		for name in playerStatCounters + sessionScores:
+			self.columns[name] = array.array('l')
+
+		self.kills = KillMatrix()
+
+		self.tables = {}
+		for kind, numTypes in (('vehicles', NUM_VEHICLE_TYPES + 1), ('weapons', NUM_WEAPON_TYPES + 1), ('kits', NUM_KIT_TYPES + 1)):
+			columns = {}
+			for name in objectStatCounters:
+				columns[name] = array.array('l')
+			for name in objectStatTimes:
+				columns[name] = array.array('d')
+			self.tables[kind] = (numTypes, columns)
+
+	def allocate(self):
+		if self.numRows == self.capacity:
+			self._grow(STORE_GROW_ROWS)
+		self.numRows += 1
+		return self.numRows - 1
+
+	# arrays are extended in place, so views onto them stay valid
+	def _grow(self, rows):
+		for column in self.columns.itervalues():
+			column.extend(array.array(column.typecode, [0]) * rows)
+		for numTypes, columns in self.tables.itervalues():
+			for column in columns.itervalues():
+				column.extend(array.array(column.typecode, [0]) * (rows * numTypes))
+		self.capacity += rows
+
+	def getTable(self, kind, statClass, row):
+		numTypes, columns = self.tables[kind]
+		return ObjectStatTable(statClass, numTypes, columns, row * numTypes)
+
+	def getNumTypes(self, kind):
+		return self.tables[kind][0]
+
+	def zeroAll(self):
+		for column in self.columns.itervalues():
+			column[:] = array.array(column.typecode, [0]) * len(column)
+		for numTypes, columns in self.tables.itervalues():
+			for column in columns.itervalues():
+				column[:] = array.array(column.typecode, [0]) * len(column)
+		self.kills.clear()
+
+	def zeroRow(self, row):
+		for column in self.columns.itervalues():
+			column[row] = 0
+		for numTypes, columns in self.tables.itervalues():
+			base = row * numTypes
+			for column in columns.itervalues():
+				column[base:base + numTypes] = array.array(column.typecode, [0]) * numTypes
+
+	# values of a column for the given rows
+	def gather(self, name, rows):
+		return map(self.columns[name].__getitem__, rows)
+
+	# values of a table column for the given type and rows
+	def gatherType(self, kind, name, type, rows):
+		numTypes, columns = self.tables[kind]
+		return [columns[name][row * numTypes + type] for row in rows]
+
+sessionStore = SessionStatStore()
+def getSessionStore():
+	return sessionStore
 
 	
 	
@@ -451,11 +757,13 @@ def onPlayerConnect(player):
 	# see if player already has a record
 	player.stats = None
 	connectingProfileId = player.getProfileId()
-	for stats in sessionPlayerStatsMap.itervalues():
-		if connectingProfileId > 0 and connectingProfileId == stats.profileId:
-			print "Found old player record, profileId ", stats.profileId
-			player.stats = stats
-			player.stats.reconnect(player)
+	if connectingProfileId > 0 and connectingProfileId in sessionPlayerProfileMap:
+		stats = sessionPlayerProfileMap[connectingProfileId]
+		print "Found old player record, profileId ", stats.profileId
+		if stats.resetPending:
+			stats.resetFields()
+		player.stats = stats
+		player.stats.reconnect(player)
 	
 	if not player.stats:
 	
@@ -468,6 +776,8 @@ def onPlayerConnect(player):
 		newPlayerStats = PlayerStat(player)
 		
 		sessionPlayerStatsMap[id] = newPlayerStats
+		if connectingProfileId > 0:
+			sessionPlayerProfileMap[connectingProfileId] = newPlayerStats
 		player.stats = sessionPlayerStatsMap[id]
 			
 		player.stats.connectionOrderNr = playerConnectionOrderIterator
@@ -529,9 +839,6 @@ def onEnterVehicle(player, vehicle, freeSoldier = False):
 		weaponType = getWeaponType(weapon.templateName)
 		player.stats.weapons[weaponType].enter(player)
 
-	if not vehicleType in player.stats.vehicles:
-		player.stats.vehicles[vehicleType] = VehicleStat()
-		
 	player.stats.vehicles[vehicleType].enter(player)
 	if vehicleType != VEHICLE_TYPE_UNKNOWN:
 		player.stats.lastVehicleType = vehicleType
@@ -575,10 +882,11 @@ def onExitVehicle(player, vehicle):
 
 def onPlayerSpawn(player, soldier):
 
-	startSpawned(player)
-	if player.getSquadId() != 0: startInSquad(player)
-	if player.isSquadLeader(): startAsSql(player)		
-	if player.isCommander(): startAsCmd(player)
+	now = date()
+	startSpawned(player, now)
+	if player.getSquadId() != 0: startInSquad(player, now)
+	if player.isSquadLeader(): startAsSql(player, now)		
+	if player.isCommander(): startAsCmd(player, now)
 
 	onEnterVehicle(player, soldier)
 	player.soldier = soldier
@@ -588,9 +896,6 @@ def onPlayerSpawn(player, soldier):
 def onPickupKit(player, kit):
 	kitType = getKitType(kit.templateName)
 
-	if not kitType in player.stats.kits:
-		player.stats.kits[kitType] = KitStat()
-
 	player.stats.kits[kitType].enter(player)
 	player.stats.lastKitType = kitType
 	
@@ -648,13 +953,7 @@ def onPlayerKilled(victim, attacker, weapon, assists, object):
 
 			# killedBy
 			if attacker != None:
-				if not victim.stats.connectionOrderNr in attacker.stats.killedPlayer:
-					attacker.stats.killedPlayer[victim.stats.connectionOrderNr] = 0
-				attacker.stats.killedPlayer[victim.stats.connectionOrderNr] += 1
-			
-				if not attacker.stats.connectionOrderNr in victim.stats.killedByPlayer:
-					victim.stats.killedByPlayer[attacker.stats.connectionOrderNr] = 0
-				victim.stats.killedByPlayer[attacker.stats.connectionOrderNr] += 1
+				attacker.stats.store.kills.add(attacker.stats.connectionOrderNr, victim.stats.connectionOrderNr)
 		
 		
 			# weapon stats
@@ -716,10 +1015,11 @@ def onPlayerDeath(victim, vehicle):
 	rootVehicle = bf2.objectManager.getRootParent(vehicle)
 	vehicleType = getVehicleType(rootVehicle.templateName)
 
-	stopSpawned(victim)
-	stopInSquad(victim)
-	stopAsSql(victim)
-	stopAsCmd(victim)
+	now = date()
+	stopSpawned(victim, now)
+	stopInSquad(victim, now)
+	stopAsSql(victim, now)
+	stopAsCmd(victim, now)
 		
 	onExitVehicle(victim, victim.soldier)
 	finalizeBulletsFired(victim)
@@ -743,110 +1043,125 @@ def onPlayerDeath(victim, vehicle):
 
 
 
-# update accuracy on weapon, kit and vehicle
+# update accuracy on weapon, kit and vehicle. the engine reports bullet counts
+# per template for the current life; only templates whose count changed since
+# the last collection are looked at.
 def collectBulletsFired(player):
 	if player == None: return
+	stats = player.stats
 	
 	# count bullets fired
-	bulletsFired = player.score.bulletsFired
-	totBulletsFired = 0
-	kitBulletsFired = 0
-	for b in bulletsFired:
-		templateName = b[0]
-		nr = b[1]
-
-		weaponType = getWeaponType(templateName)
-		player.stats.weapons[weaponType].bulletsFiredTemp = nr
-		totBulletsFired += nr
+	totBulletsFired, kitBulletsFired = collectBulletCounts(stats, player.score.bulletsFired, stats.bulletsFiredSeen, 'bulletsFiredTemp')
+	stats.lifeBulletsFired += totBulletsFired
+	stats.lifeKitBulletsFired += kitBulletsFired
 
-		# only count kit stats for soldier-type weapons
-		if weaponType != WEAPON_TYPE_UNKNOWN:
-			kitBulletsFired += nr
-					
-	
 	# count bullets hit 
-	bulletsHit = player.score.bulletsGivingDamage
-	totBulletsHit = 0
-	kitBulletsHit = 0
-	for b in bulletsHit:
-		templateName = b[0]
-		nr = b[1]
-
-		weaponType = getWeaponType(templateName)
-		player.stats.weapons[weaponType].bulletsHitTemp = nr
-		totBulletsHit += nr
-
-		# only count kit stats for soldier-type weapons
-		if weaponType != WEAPON_TYPE_UNKNOWN:
-			kitBulletsHit += nr
-	
+	totBulletsHit, kitBulletsHit = collectBulletCounts(stats, player.score.bulletsGivingDamage, stats.bulletsHitSeen, 'bulletsHitTemp')
+	stats.lifeBulletsHit += totBulletsHit
+	stats.lifeKitBulletsHit += kitBulletsHit
 
 	# dont bother giving kit stats if we're in a vehicle
 	kit = player.getKit()
 	if kit != None:
 		kitType = getKitType(kit.templateName)
-		player.stats.kits[kitType].bulletsFiredTemp = kitBulletsFired
-		player.stats.kits[kitType].bulletsHitTemp = kitBulletsHit
+		stats.kits[kitType].bulletsFiredTemp = stats.lifeKitBulletsFired
+		stats.kits[kitType].bulletsHitTemp = stats.lifeKitBulletsHit
+		stats.tempKits[kitType] = 1
 
 	vehicle = player.getVehicle()
 	if vehicle != None:
 		rootVehicle = bf2.objectManager.getRootParent(vehicle)
 		vehicleType = getVehicleType(rootVehicle.templateName)
 
-		player.stats.vehicles[vehicleType].bulletsFiredTemp = totBulletsFired
-		player.stats.vehicles[vehicleType].bulletsHitTemp = totBulletsHit
+		stats.vehicles[vehicleType].bulletsFiredTemp = stats.lifeBulletsFired
+		stats.vehicles[vehicleType].bulletsHitTemp = stats.lifeBulletsHit
+		stats.tempVehicles[vehicleType] = 1
 		
 
 
+# adds the change of each template count since the last collection to the temp
+# counter of its weapon. returns the change of all and of soldier weapons.
+def collectBulletCounts(stats, bullets, seen, tempName):
+	changed = [b for b in bullets if seen.get(b[0], 0) != b[1]]
+	if not changed: return 0, 0
+
+	total = 0
+	kitTotal = 0
+	for (template, nr), types in zip(changed, classifyTemplates([b[0] for b in changed])):
+		diff = nr - seen.get(template, 0)
+		seen[template] = nr
+
+		weaponType = types[1]
+		weapon = stats.weapons[weaponType]
+		setattr(weapon, tempName, getattr(weapon, tempName) + diff)
+		stats.tempWeapons[weaponType] = 1
+		total += diff
+
+		# only count kit stats for soldier-type weapons
+		if weaponType != WEAPON_TYPE_UNKNOWN:
+			kitTotal += diff
+
+	return total, kitTotal
+
+
+
 def clearBulletsFired(player):
 	bulletsFired = player.score.bulletsFiredAndClear
 	bulletsHit = player.score.bulletsGivingDamageAndClear
 
 
 
+# add the collected counts to the totals. only the weapons, kits and vehicles
+# that were given counts since the last flush are touched.
 def finalizeBulletsFired(player):
-	for v in player.stats.vehicles.itervalues():
+	stats = player.stats
+	for t in stats.tempVehicles:
+		v = stats.vehicles[t]
 		v.bulletsFired += v.bulletsFiredTemp
 		v.bulletsHit += v.bulletsHitTemp
 		v.bulletsFiredTemp = 0
 		v.bulletsHitTemp = 0
-	for w in player.stats.weapons.itervalues():
+	for t in stats.tempWeapons:
+		w = stats.weapons[t]
 		w.bulletsFired += w.bulletsFiredTemp
 		w.bulletsHit += w.bulletsHitTemp
-		player.stats.bulletsFired += w.bulletsFiredTemp
-		player.stats.bulletsHit += w.bulletsHitTemp
+		stats.bulletsFired += w.bulletsFiredTemp
+		stats.bulletsHit += w.bulletsHitTemp
 		w.bulletsFiredTemp = 0
 		w.bulletsHitTemp = 0
-	for k in player.stats.kits.itervalues():
+	for t in stats.tempKits:
+		k = stats.kits[t]
 		k.bulletsFired += k.bulletsFiredTemp
 		k.bulletsHit += k.bulletsHitTemp
 		k.bulletsFiredTemp = 0
 		k.bulletsHitTemp = 0
 
+	stats.resetBullets()
+
 
 
-def startSpawned(player): 
-	player.stats.spawnedAt = date()
+def startSpawned(player, now=None): 
+	if now == None: now = date()
+	player.stats.spawnedAt = now
 	player.stats.spawnedTeam = player.getTeam()
-def startInSquad(player): player.stats.joinedSquadAt = date()
-def startAsSql(player): player.stats.becameSqlAt = date()
-def startAsCmd(player): player.stats.becameCmdAt = date()
-
-
-
-def stopSpawned(player):
-	time = player.stats.timePlayed
-	player.stats.spawnedAt = 0
-	player.stats.spawnedTeam = 3
-def stopInSquad(player): 
-	time = player.stats.timeInSquad
-	player.stats.joinedSquadAt = 0
-def stopAsSql(player): 
-	time = player.stats.timeAsSql
-	player.stats.becameSqlAt = 0
-def stopAsCmd(player): 
-	time = player.stats.timeAsCmd
-	player.stats.becameCmdAt = 0
+def startInSquad(player, now=None): player.stats.joinedSquadAt = now or date()
+def startAsSql(player, now=None): player.stats.becameSqlAt = now or date()
+def startAsCmd(player, now=None): player.stats.becameCmdAt = now or date()
+
+
+
+def stopSpawned(player, now=None):
+	stats = player.stats
+	if stats.spawnedAt:
+		if now == None: now = date()
+		timeDiff = now - stats.spawnedAt
+		stats.rawTimePlayed += timeDiff
+		stats.timeAsArmy[roundArmies[stats.spawnedTeam]] += timeDiff
+		stats.spawnedAt = 0
+	stats.spawnedTeam = 3
+def stopInSquad(player, now=None): player.stats.stopTime('timeInSquad', now)
+def stopAsSql(player, now=None): player.stats.stopTime('timeAsSql', now)
+def stopAsCmd(player, now=None): player.stats.stopTime('timeAsCmd', now)
 	
 	
 	
@@ -0,0 +1,247 @@
+# data-driven vehicle/weapon/kit/army/map type tables.
+#
+# table files are read from <modDir>/settings/stattypes/*.tbl and extend (or
+# override) the maps in bf2.stats.constants. a table file looks like:
+#
+#   # PR:BF2 additions
+#   [vehicle]
+#   gb_tnk_challenger2	= ARMOR
+#   *_jeep*		= TRANSPORT
+#
+#   [weapon]
+#   *_sniper		= SNIPER
+#
+# sections are vehicle, weapon, kit, army and map. values are the constant
+# names without their prefix (ARMOR for VEHICLE_TYPE_ARMOR) or plain numbers.
+# names with wildcards become pattern rules that are tried in file order for
+# names not found in the exact maps.
+#
+# the parsed tables are compiled into an index file next to the tables, which
+# is reused as long as no table file changed. tables are reloaded between
+# rounds when they have been modified.
+
+import host
+import os
+import glob
+import marshal
+import bf2
+import bf2.stats.constants as constants
+from bf2 import g_debug
+
+TABLE_DIR = "settings/stattypes"
+TABLE_PATTERN = "*.tbl"
+INDEX_NAME = "stattypes.idx"
+INDEX_VERSION = 2
+
+# section -> (exact map, rule list, constant prefix) in bf2.stats.constants
+tableKinds = {
+	"vehicle"	: ("vehicleTypeMap", "vehicleTypeRules", "VEHICLE_TYPE_"),
+	"weapon"	: ("weaponTypeMap", "weaponTypeRules", "WEAPON_TYPE_"),
+	"kit"		: ("kitTypeMap", "kitTypeRules", "KIT_TYPE_"),
+	"army"		: ("armyMap", "armyRules", "ARMY_"),
+	"map"		: ("mapMap", "mapRules", None),
+}
+
+# highest type id per section. ids index the fixed size stat tables, so ids
+# past these are rejected when the tables are read. map ids arent bounded.
+maxTypeIds = {
+	"vehicle"	: constants.NUM_VEHICLE_TYPES,
+	"weapon"	: constants.NUM_WEAPON_TYPES,
+	"kit"		: constants.NUM_KIT_TYPES,
+	"army"		: constants.NUM_ARMIES,
+	"map"		: None,
+}
+
+# the hardcoded maps, restored before each set of tables is applied
+builtinMaps = {}
+for kind, (mapName, rulesName, prefix) in tableKinds.iteritems():
+	builtinMaps[kind] = getattr(constants, mapName).copy()
+del kind, mapName, rulesName, prefix
+
+loadedSignature = None
+
+
+
+def init():
+	host.registerGameStatusHandler(onGameStatusChanged)
+	reload()
+
+	if g_debug: print "Stat type tables module initialized."
+
+
+
+def onGameStatusChanged(status):
+	if status == bf2.GameStatus.PreGame:
+		reload()
+
+
+
+def getTableDir():
+	return bf2.gameLogic.getModDir() + "/" + TABLE_DIR
+
+
+
+# loads the tables if any table file changed since the last load. returns
+# True if new tables were applied.
+def reload(force=False):
+	global loadedSignature
+
+	tableDir = getTableDir()
+	fileNames = glob.glob(tableDir + "/" + TABLE_PATTERN)
+	fileNames.sort()
+	signature = getSignature(fileNames)
+	if signature == loadedSignature and not force:
+		return False
+
+	indexName = tableDir + "/" + INDEX_NAME
+	tables = readIndex(indexName, signature)
+	if tables == None:
+		tables = compileTables(fileNames)
+		if fileNames:
+			writeIndex(indexName, signature, tables)
+
+	applyTables(tables)
+	loadedSignature = signature
+
+	if fileNames:
+		print "Loaded stat type tables from %d file(s) in %s" % (len(fileNames), tableDir)
+	return True
+
+
+
+def getSignature(fileNames):
+	signature = []
+	for fileName in fileNames:
+		try:
+			st = os.stat(fileName)
+		except OSError:
+			continue
+		signature.append((os.path.basename(fileName), int(st.st_mtime), st.st_size))
+	return signature
+
+
+
+def readIndex(indexName, signature):
+	try:
+		f = open(indexName, "rb")
+	except IOError:
+		return None
+
+	try:
+		try:
+			version, indexSignature, tables = marshal.load(f)
+		except (EOFError, ValueError, TypeError):
+			return None
+	finally:
+		f.close()
+
+	if version != INDEX_VERSION or indexSignature != signature:
+		return None
+	return tables
+
+
+
+def writeIndex(indexName, signature, tables):
+	try:
+		f = open(indexName, "wb")
+		try:
+			marshal.dump((INDEX_VERSION, signature, tables), f)
+		finally:
+			f.close()
+	except IOError:
+		print "Couldnt write stat type index: ", indexName
+
+
+
+# parses table files into {kind: (exact dict, rule list)}
+def compileTables(fileNames):
+	tables = {}
+	for kind in tableKinds.iterkeys():
+		tables[kind] = ({}, [])
+
+	for fileName in fileNames:
+		try:
+			f = open(fileName, "r")
+		except IOError:
+			print "Couldnt read stat type table: ", fileName
+			continue
+
+		kind = None
+		lineNo = 0
+		for line in f:
+			lineNo += 1
+			line = line.split("#")[0].strip()
+			if not line: continue
+
+			if line[0] == "[" and line[-1] == "]":
+				kind = line[1:-1].strip().lower()
+				if not kind in tableKinds:
+					print "%s:%d: unknown section %s" % (fileName, lineNo, kind)
+					kind = None
+				continue
+
+			if kind == None or line.find("=") == -1:
+				print "%s:%d: ignored line" % (fileName, lineNo)
+				continue
+
+			name, value = line.split("=", 1)
+			name = name.strip().lower()
+			value = parseValue(kind, value.strip())
+			if value == None:
+				print "%s:%d: unknown type for %s" % (fileName, lineNo, name)
+				continue
+			if value < 0 or (maxTypeIds[kind] != None and value > maxTypeIds[kind]):
+				print "%s:%d: type %d out of range for %s" % (fileName, lineNo, value, name)
+				continue
+
+			exact, rules = tables[kind]
+			if name.find("*") == -1 and name.find("?") == -1:
+				exact[name] = value
+			else:
+				rules.append(compileRule(name, value))
+		f.close()
+
+	return tables
+
+
+
+def parseValue(kind, value):
+	try:
+		return int(value)
+	except ValueError:
+		pass
+
+	prefix = tableKinds[kind][2]
+	if prefix == None: return None
+	value = value.upper()
+	if not value.startswith(prefix):
+		value = prefix + value
+	return getattr(constants, value, None)
+
+
+
+def compileRule(pattern, value):
+	inner = pattern.strip("*")
+	if inner.find("*") == -1 and inner.find("?") == -1:
+		if pattern.startswith("*") and pattern.endswith("*"):
+			return (constants.RULE_CONTAINS, inner, value)
+		elif pattern.endswith("*"):
+			return (constants.RULE_PREFIX, inner, value)
+		elif pattern.startswith("*"):
+			return (constants.RULE_SUFFIX, inner, value)
+	return (constants.RULE_GLOB, pattern, value)
+
+
+
+def applyTables(tables):
+	for kind, (mapName, rulesName, prefix) in tableKinds.iteritems():
+		exact, rules = tables[kind]
+
+		# other modules hold references to these, so update them in place
+		typeMap = getattr(constants, mapName)
+		typeMap.clear()
+		typeMap.update(builtinMaps[kind])
+		typeMap.update(exact)
+		getattr(constants, rulesName)[:] = rules
+
+	constants.clearTemplateTypeCache()